@@ -0,0 +1,258 @@
+#    Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+#
+#        http://aws.amazon.com/apache2.0/
+#
+#    or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+import re
+import time
+import threading
+from botocore.exceptions import ClientError
+
+cfn_poll_min_interval = 2
+cfn_poll_max_interval = 20
+cfn_poll_backoff = 1.5
+cfn_list_max_pages = 3
+
+class CfnTemplateLocalizer():
+    """Rewrites a copy of the single-rule template so that it can be merged with other rules into one template.
+
+    Parameter references are replaced with the rule's values and every resource and condition logical ID gets the rule's suffix.
+    """
+    def __init__(self, parameter_values, logical_ids, suffix):
+        self.parameter_values = parameter_values
+        self.logical_ids = logical_ids
+        self.suffix = suffix
+
+    def localize(self, node):
+        if isinstance(node, list):
+            return [self.localize(item) for item in node]
+
+        if not isinstance(node, dict):
+            return node
+
+        if len(node) == 1:
+            key, value = list(node.items())[0]
+            if key == 'Ref':
+                if value in self.parameter_values:
+                    return self.parameter_values[value]
+                return {'Ref': self.__rename(value)}
+            if key == 'Fn::GetAtt':
+                return {'Fn::GetAtt': [self.__rename(value[0])] + value[1:]}
+            if key == 'Fn::Sub':
+                if isinstance(value, list):
+                    return {'Fn::Sub': [self.__localize_sub(value[0]), self.localize(value[1])]}
+                return {'Fn::Sub': self.__localize_sub(value)}
+            if key == 'Fn::If':
+                return {'Fn::If': [self.__rename(value[0])] + self.localize(value[1:])}
+            if key == 'Condition':
+                return {'Condition': self.__rename(value)}
+
+        my_node = {}
+        for key, value in node.items():
+            if key == 'DependsOn':
+                my_node[key] = [self.__rename(v) for v in value] if isinstance(value, list) else self.__rename(value)
+            elif key == 'Condition' and not isinstance(value, dict):
+                my_node[key] = self.__rename(value)
+            else:
+                my_node[key] = self.localize(value)
+        return my_node
+
+    def __rename(self, logical_id):
+        if logical_id in self.logical_ids:
+            return logical_id + self.suffix
+        return logical_id
+
+    def __localize_sub(self, sub_string):
+        def replace_variable(match):
+            variable = match.group(1)
+            name = variable.split('.')[0]
+            if name in self.parameter_values and not isinstance(self.parameter_values[name], list):
+                return self.parameter_values[name]
+            if name in self.logical_ids:
+                return '${' + self.__rename(name) + variable[len(name):] + '}'
+            return match.group(0)
+
+        return re.sub(r'\$\{([^!][^}]*)\}', replace_variable, sub_string)
+
+class CfnStackTracker():
+    """Waits for CloudFormation stack operations, streaming new stack events and timing each resource operation.
+
+    Any number of threads may wait on different stacks at once.  Each poll fetches the status of every stack being waited on
+    with a single describe_stacks call, and the polling interval backs off while nothing is happening.  CloudFormation has no
+    call for several stacks' events, so each stack still in progress has its events read separately.  An error while polling
+    one stack is raised only to the thread waiting on that stack, and throttled stacks are retried with backoff.
+    """
+    #Stack-level statuses that mark the start of a new stack operation.
+    operation_start_statuses = ['CREATE_IN_PROGRESS', 'UPDATE_IN_PROGRESS', 'DELETE_IN_PROGRESS', 'IMPORT_IN_PROGRESS']
+    throttling_error_codes = ['Throttling', 'ThrottlingException', 'RequestLimitExceeded']
+
+    def __init__(self, cfn_client, output):
+        self.cfn_client = cfn_client
+        self.output = output
+        self.interval = cfn_poll_min_interval
+        self.last_poll = 0
+        self.stacks = {}
+        self.state_lock = threading.Lock()
+        self.poll_lock = threading.Lock()
+
+    def wait(self, stack_name):
+        with self.state_lock:
+            my_state = {'stack': None, 'done': False, 'error': None, 'retry_at': 0, 'retry_delay': cfn_poll_min_interval, 'started': time.time(), 'seen_events': set(), 'resource_starts': {}, 'timings': []}
+            self.stacks[stack_name] = my_state
+            #A new stack has joined, so poll at the fastest rate again.
+            self.interval = cfn_poll_min_interval
+
+        try:
+            while not my_state['done']:
+                #Only one thread polls at a time, on behalf of every waiting thread.
+                with self.poll_lock:
+                    if my_state['done']:
+                        break
+
+                    #Stacks that have not been polled yet are checked immediately, unless they are backing off from throttling.
+                    poll_at = my_state['retry_at']
+                    if my_state['stack'] is not None:
+                        poll_at = max(poll_at, self.last_poll + self.interval)
+                    delay = poll_at - time.time()
+                    if delay <= 0:
+                        self.__poll()
+                        continue
+
+                #Sleep without the lock, so that a stack joining meanwhile gets its first poll straight away.  Another thread's
+                #poll may finish this stack in the meantime, so don't sleep for long before checking again.
+                time.sleep(min(delay, cfn_poll_min_interval))
+        finally:
+            with self.state_lock:
+                del self.stacks[stack_name]
+
+        if my_state['error']:
+            raise my_state['error']
+
+        self.__print_timings(stack_name, my_state)
+        return my_state['stack']
+
+    def __poll(self):
+        now = time.time()
+        with self.state_lock:
+            pending = dict((name, state) for name, state in self.stacks.items() if not state['done'] and state['retry_at'] <= now)
+
+        try:
+            my_stacks = self.__describe_stacks(list(pending.keys())) if len(pending) > 1 else {}
+        except ClientError as e:
+            if e.response['Error']['Code'] in self.throttling_error_codes:
+                self.last_poll = time.time()
+                self.interval = min(self.interval * cfn_poll_backoff, cfn_poll_max_interval)
+                return
+            #Fall back to describing each stack, so the error reaches the stacks it belongs to.
+            my_stacks = {}
+        self.last_poll = time.time()
+
+        saw_events = False
+        for stack_name, my_state in pending.items():
+            try:
+                if self.__poll_stack(stack_name, my_state, my_stacks.get(stack_name)):
+                    saw_events = True
+                my_state['retry_delay'] = cfn_poll_min_interval
+            except ClientError as e:
+                if e.response['Error']['Code'] in self.throttling_error_codes:
+                    my_state['retry_at'] = time.time() + my_state['retry_delay']
+                    my_state['retry_delay'] = min(my_state['retry_delay'] * cfn_poll_backoff, cfn_poll_max_interval)
+                else:
+                    my_state['error'] = e
+                    my_state['done'] = True
+
+        #Poll quickly while stacks are making progress, and back off while they are quiet.
+        if saw_events:
+            self.interval = cfn_poll_min_interval
+        else:
+            self.interval = min(self.interval * cfn_poll_backoff, cfn_poll_max_interval)
+
+    def __poll_stack(self, stack_name, my_state, my_stack):
+        if my_stack is None:
+            #A single stack, and stacks that were deleted or are beyond the pages listed, are looked up directly.
+            my_stack = self.cfn_client.describe_stacks(StackName=stack_name)['Stacks'][0]
+
+        first_poll = my_state['stack'] is None
+        in_progress = my_stack['StackStatus'].endswith('IN_PROGRESS')
+
+        #A stack that was already settled when we started waiting has no events worth showing.
+        saw_events = False
+        if in_progress or not first_poll:
+            saw_events = self.__stream_events(stack_name, my_state)
+
+        my_state['stack'] = my_stack
+        if not in_progress:
+            my_state['done'] = True
+        return saw_events
+
+    def __describe_stacks(self, stack_names):
+        #With several stacks in flight, one paginated listing is cheaper than describing each stack.  In accounts with many stacks
+        #only the first few pages are read, and stacks that weren't found are described one at a time.
+        my_stacks = {}
+        describe_args = {}
+        for page in range(cfn_list_max_pages):
+            response = self.cfn_client.describe_stacks(**describe_args)
+            for my_stack in response['Stacks']:
+                if my_stack['StackName'] in stack_names:
+                    my_stacks[my_stack['StackName']] = my_stack
+            if 'NextToken' not in response or len(my_stacks) == len(stack_names):
+                break
+            describe_args['NextToken'] = response['NextToken']
+
+        return my_stacks
+
+    def __stream_events(self, stack_name, my_state):
+        #Events come back newest first.  Page back until we reach events we have already seen or the start of the current operation.
+        new_events = []
+        describe_args = {'StackName': stack_name}
+        reached_end = False
+        while not reached_end:
+            response = self.cfn_client.describe_stack_events(**describe_args)
+            for event in response['StackEvents']:
+                if event['EventId'] in my_state['seen_events']:
+                    reached_end = True
+                    break
+                new_events.append(event)
+                if event['LogicalResourceId'] == stack_name and event['ResourceStatus'] in self.operation_start_statuses:
+                    reached_end = True
+                    break
+            if 'NextToken' not in response:
+                break
+            describe_args['NextToken'] = response['NextToken']
+
+        for event in reversed(new_events):
+            my_state['seen_events'].add(event['EventId'])
+            self.__record_event(stack_name, my_state, event)
+
+        return len(new_events) > 0
+
+    def __record_event(self, stack_name, my_state, event):
+        message = event['Timestamp'].strftime('%H:%M:%S') + " " + event['ResourceStatus'] + " " + event['ResourceType'] + " " + event['LogicalResourceId']
+        if event.get('ResourceStatusReason'):
+            message = message + " - " + event['ResourceStatusReason']
+        self.output(stack_name, message)
+
+        #Track how long each resource operation took, from its first IN_PROGRESS event to its final status.
+        logical_id = event['LogicalResourceId']
+        if logical_id == stack_name:
+            return
+
+        if event['ResourceStatus'].endswith('IN_PROGRESS'):
+            if logical_id not in my_state['resource_starts']:
+                my_state['resource_starts'][logical_id] = event['Timestamp']
+        elif logical_id in my_state['resource_starts']:
+            started = my_state['resource_starts'].pop(logical_id)
+            duration = event['Timestamp'] - started
+            my_state['timings'].append((duration.total_seconds(), logical_id, event['ResourceType'], event['ResourceStatus']))
+
+    def __print_timings(self, stack_name, my_state):
+        if not my_state['timings']:
+            return
+
+        lines = ["Stack " + my_state['stack']['StackStatus'] + " after " + str(int(time.time() - my_state['started'])) + " seconds.  Resource timings:"]
+        for seconds, logical_id, resource_type, status in sorted(my_state['timings'], reverse=True):
+            lines.append("\t" + "{0:7.1f}".format(seconds) + "s  " + logical_id + " (" + resource_type + ") " + status)
+        self.output(stack_name, '\n'.join(lines))
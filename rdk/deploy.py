@@ -0,0 +1,123 @@
+#    Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+#
+#        http://aws.amazon.com/apache2.0/
+#
+#    or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+import time
+import threading
+import subprocess
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+build_commands = {
+    'java8': [["gradle","build"]],
+    'dotnetcore1.0': [["dotnet","restore"], ["dotnet","lambda","package","-c","Release","-f","netcoreapp1.0"]]
+}
+
+def run_rule_build(rule_name, runtime, working_dir):
+    #Runs in a build worker process.  Output is captured so that parallel builds don't interleave on the console.
+    start_time = time.time()
+    output = []
+    for command in build_commands[runtime]:
+        try:
+            process = subprocess.Popen(command, cwd=working_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError as e:
+            return (rule_name, 1, "Could not run " + command[0] + ": " + str(e), time.time() - start_time)
+
+        stdout = process.communicate()[0]
+        output.append(stdout.decode('utf-8', 'replace'))
+        if process.returncode != 0:
+            return (rule_name, process.returncode, ''.join(output), time.time() - start_time)
+
+    return (rule_name, 0, ''.join(output), time.time() - start_time)
+
+class DeployPipeline():
+    """Moves items through a series of stages connected by queues, with each stage running in its own worker threads.
+
+    A stage is a (name, function, workers) tuple.  The function takes an item and returns None to pass it on to the next
+    stage, or an error message to drop it from the pipeline.  How long each item waited for and spent in each stage is
+    recorded, so the stage holding up the pipeline can be identified.
+    """
+    def __init__(self, stages, output):
+        self.stages = stages
+        self.output = output
+        self.queues = [queue.Queue() for stage in stages]
+        self.timings = dict((name, []) for name, function, workers in stages)
+        self.results = {}
+        self.remaining = 0
+        self.finished = threading.Condition()
+
+    def run(self, items, get_name):
+        self.remaining = len(items)
+        workers = []
+        for index, stage in enumerate(self.stages):
+            for i in range(stage[2]):
+                worker = threading.Thread(target=self.__work, args=(index, get_name))
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+
+        for item in items:
+            self.queues[0].put((item, time.time(), []))
+
+        #Wait with a timeout so that Ctrl-C is still noticed.
+        with self.finished:
+            while self.remaining:
+                self.finished.wait(1)
+
+        for index, stage in enumerate(self.stages):
+            for i in range(stage[2]):
+                self.queues[index].put(None)
+        for worker in workers:
+            worker.join()
+
+        return self.results
+
+    def print_timings(self):
+        lines = ["Stage timings:", "\t" + "stage".ljust(14) + "rules".rjust(6) + "busy".rjust(10) + "queued".rjust(10) + "   slowest"]
+        for name, function, workers in self.stages:
+            my_timings = self.timings[name]
+            if not my_timings:
+                continue
+            busy = sum(timing[2] for timing in my_timings)
+            queued = sum(timing[1] for timing in my_timings)
+            slowest = max(my_timings, key=lambda timing: timing[2])
+            lines.append("\t" + name.ljust(14) + str(len(my_timings)).rjust(6) + "{0:9.1f}s".format(busy) + "{0:9.1f}s".format(queued) + "   " + slowest[0] + " " + "{0:.1f}s".format(slowest[2]))
+        print('\n'.join(lines))
+
+    def __work(self, index, get_name):
+        name = self.stages[index][0]
+        function = self.stages[index][1]
+        while True:
+            entry = self.queues[index].get()
+            if entry is None:
+                return
+
+            item, queued_at, item_timings = entry
+            item_name = get_name(item)
+            started = time.time()
+            try:
+                error = function(item)
+            except (Exception, SystemExit) as e:
+                error = str(e) or e.__class__.__name__
+                self.output(item_name, "Error during " + name + ": " + error)
+            finished = time.time()
+
+            with self.finished:
+                self.timings[name].append((item_name, started - queued_at, finished - started))
+            item_timings.append(name + " " + "{0:.1f}s".format(finished - started))
+
+            if error is None and index + 1 < len(self.stages):
+                self.queues[index + 1].put((item, finished, item_timings))
+                continue
+
+            self.output(item_name, "Stage timings: " + ", ".join(item_timings))
+            with self.finished:
+                self.results[item_name] = error
+                self.remaining -= 1
+                self.finished.notify_all()
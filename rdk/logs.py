@@ -0,0 +1,292 @@
+#    Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+#
+#        http://aws.amazon.com/apache2.0/
+#
+#    or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+import re
+import sys
+import json
+import time
+import heapq
+import shutil
+import signal
+import sqlite3
+import argparse
+from botocore.exceptions import ClientError
+
+log_poll_min_interval = 1
+log_poll_max_interval = 16
+log_poll_backoff = 2
+log_report_pattern = re.compile(r'(Duration|Billed Duration|Init Duration|Max Memory Used|Memory Size): ([0-9.]+) (ms|MB)')
+log_report_metrics = ['Duration (ms)', 'Billed Duration (ms)', 'Init Duration (ms)', 'Max Memory Used (MB)', 'Memory Size (MB)']
+log_time_units = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+log_time_formats = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']
+
+def parse_log_time(value):
+    #Returns the time in milliseconds, for --start and --end of the logs command.
+    match = re.match(r'^(\d+)([smhd])$', value)
+    if match:
+        return int((time.time() - int(match.group(1)) * log_time_units[match.group(2)]) * 1000)
+
+    for time_format in log_time_formats:
+        try:
+            return int(time.mktime(time.strptime(value, time_format)) * 1000)
+        except ValueError:
+            pass
+
+    raise argparse.ArgumentTypeError("'" + value + "' is not a time like 2017-11-15T22:00:00, 2017-11-15, or 30m, 2h or 1d ago.")
+
+def parse_log_metrics(message):
+    #Returns (name, value) pairs from a Lambda REPORT line or an embedded metric format line, or nothing for other log messages.
+    if message.startswith('REPORT '):
+        return [(match.group(1) + " (" + match.group(3) + ")", float(match.group(2))) for match in log_report_pattern.finditer(message)]
+
+    if '"_aws"' not in message:
+        return []
+    try:
+        document = json.loads(message[message.index('{'):])
+        metric_definitions = [metric for directive in document['_aws']['CloudWatchMetrics'] for metric in directive['Metrics']]
+    except (ValueError, KeyError, TypeError):
+        return []
+
+    metrics = []
+    for metric in metric_definitions:
+        if isinstance(document.get(metric['Name']), (int, float)):
+            unit = {'Milliseconds': 'ms', 'Megabytes': 'MB', 'Count': ''}.get(metric.get('Unit'), metric.get('Unit', ''))
+            metrics.append((metric['Name'] + (" (" + unit + ")" if unit else ""), float(document[metric['Name']])))
+    return metrics
+
+def tag_log_event(event, log_group_name, log_stream_name, rule_name):
+    #Record where an event came from, since events from several streams and rules are shown together.
+    event['logGroupName'] = log_group_name
+    if log_stream_name:
+        event['logStreamName'] = log_stream_name
+    if rule_name:
+        event['ruleName'] = rule_name
+    return event
+
+def merge_log_events(event_lists):
+    #Merges lists of events that are each in time order into one list in time order.
+    def decorate(list_index, events):
+        for position, event in enumerate(events):
+            yield (event['timestamp'], list_index, position, event)
+
+    return [item[3] for item in heapq.merge(*[decorate(list_index, events) for list_index, events in enumerate(event_lists)])]
+
+class LogRenderer():
+    """Writes CloudWatch log events to a stream, a batch at a time.
+
+    The text format shows each event with its local time and wraps long lines to the terminal width.  The width is read
+    once, and again only after the terminal has been resized, and lines are not wrapped when the stream isn't a terminal.
+    The raw format writes just the messages, and the json format writes each event as a line of JSON, for piping to other
+    tools.
+    """
+    formats = ['text', 'raw', 'json']
+    timestamp_width = 22
+
+    def __init__(self, output_format='text', stream=None):
+        self.output_format = output_format
+        self.stream = stream or sys.stdout
+        self.is_terminal = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.line_wrap = None
+        self.resized = True
+        self.last_second = None
+        self.last_time_string = None
+        if self.is_terminal and hasattr(signal, 'SIGWINCH'):
+            try:
+                signal.signal(signal.SIGWINCH, self.__on_resize)
+            except ValueError:
+                #Signal handlers can only be set from the main thread, so fall back to the width read at the start.
+                pass
+
+    def write(self, events):
+        if self.output_format == 'json':
+            lines = [json.dumps(event, default=str) for event in events]
+        elif self.output_format == 'raw':
+            lines = [self.__get_prefix(event) + str(event['message']).rstrip('\n') for event in events]
+        else:
+            if self.resized:
+                self.resized = False
+                self.line_wrap = self.__get_line_wrap()
+            lines = [self.__format_event(event) for event in events]
+
+        if lines:
+            self.stream.write('\n'.join(lines) + '\n')
+            self.stream.flush()
+
+    def __format_event(self, event):
+        #Events arrive in bursts, so many share the same second.
+        second = event['timestamp'] // 1000
+        if second != self.last_second:
+            self.last_second = second
+            self.last_time_string = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+
+        formatted_lines = []
+        for line in str(event['message']).rstrip('\n').splitlines():
+            line = line.replace('\t', '    ')
+            if self.line_wrap and len(line) > self.line_wrap:
+                line = '\n'.join(line[i:i+self.line_wrap] for i in range(0, len(line), self.line_wrap))
+            formatted_lines.append(line)
+
+        message_string = '\n'.join(formatted_lines).replace('\n', '\n' + ' ' * self.timestamp_width)
+        return self.last_time_string + " - " + self.__get_prefix(event) + message_string
+
+    def __get_prefix(self, event):
+        #When several rules' logs are shown together, each event is tagged with its rule.
+        if event.get('ruleName'):
+            return "[" + event['ruleName'] + "] "
+        return ""
+
+    def __get_line_wrap(self):
+        if not self.is_terminal:
+            return None
+        try:
+            if hasattr(shutil, 'get_terminal_size'):
+                columns = shutil.get_terminal_size().columns
+            else:
+                import fcntl, termios, struct
+                rows, columns = struct.unpack('hh', fcntl.ioctl(self.stream.fileno(), termios.TIOCGWINSZ, b'    '))
+        except Exception:
+            return None
+        return max(columns - self.timestamp_width, 20)
+
+    def __on_resize(self, signum, frame):
+        self.resized = True
+
+class LogArchive():
+    """A local SQLite copy of rules' log events, indexed by rule and time.
+
+    Events are keyed by their eventId, so storing the same event again has no effect.  Each log group has a checkpoint,
+    the timestamp of the newest event synced from it, for the next sync to start from.
+    """
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS events (event_id TEXT PRIMARY KEY, rule_name TEXT NOT NULL, log_group TEXT NOT NULL, log_stream TEXT, timestamp INTEGER NOT NULL, ingestion_time INTEGER, message TEXT)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS events_rule_timestamp ON events (rule_name, timestamp)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS checkpoints (log_group TEXT PRIMARY KEY, rule_name TEXT NOT NULL, timestamp INTEGER NOT NULL, synced_at INTEGER NOT NULL)")
+
+    def store(self, log_group_name, rule_name, events):
+        #Returns the number of events that were not in the archive yet.
+        changes = self.connection.total_changes
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO events (event_id, rule_name, log_group, log_stream, timestamp, ingestion_time, message) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(event['eventId'], rule_name, log_group_name, event.get('logStreamName'), event['timestamp'], event.get('ingestionTime'), event['message']) for event in events])
+        return self.connection.total_changes - changes
+
+    def get_checkpoint(self, log_group_name):
+        row = self.connection.execute("SELECT timestamp FROM checkpoints WHERE log_group = ?", (log_group_name,)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def set_checkpoint(self, log_group_name, rule_name, timestamp):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO checkpoints (log_group, rule_name, timestamp, synced_at) VALUES (?, ?, ?, ?)", (log_group_name, rule_name, timestamp, int(time.time() * 1000)))
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def query(self, rule_names, start_time=None, end_time=None, text=None, number_of_events=None):
+        #Returns the matching events in time order, or the latest number_of_events of them.  Each word of text has to appear in the message.
+        conditions = ["rule_name IN (" + ", ".join("?" for rule_name in rule_names) + ")"]
+        parameters = list(rule_names)
+        if start_time:
+            conditions.append("timestamp >= ?")
+            parameters.append(start_time)
+        if end_time:
+            conditions.append("timestamp <= ?")
+            parameters.append(end_time)
+        for word in (text or '').split():
+            conditions.append("message LIKE ? ESCAPE '\\'")
+            parameters.append('%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+
+        sql = "SELECT event_id, rule_name, log_group, log_stream, timestamp, ingestion_time, message FROM events WHERE " + " AND ".join(conditions) + " ORDER BY timestamp DESC, event_id DESC"
+        if number_of_events:
+            sql += " LIMIT ?"
+            parameters.append(number_of_events)
+
+        events = []
+        for event_id, rule_name, log_group_name, log_stream_name, timestamp, ingestion_time, message in self.connection.execute(sql, parameters):
+            event = {'eventId': event_id, 'timestamp': timestamp, 'ingestionTime': ingestion_time, 'message': message}
+            tag_log_event(event, log_group_name, log_stream_name, rule_name if len(rule_names) > 1 else None)
+            events.append(event)
+        events.reverse()
+        return events
+
+    def close(self):
+        self.connection.close()
+
+class LogTailer():
+    """Follows a log group, returning the events that have arrived since the last poll.
+
+    Each poll reads every page of new events.  Polls start at the timestamp of the newest event seen so far rather than just
+    after it, so that events sharing that timestamp which arrive late are not lost, and the events already seen at that
+    timestamp are skipped.  Without any events to start from, the first poll starts at start_time, or at the time the tailer
+    was created.  The interval to wait before the next poll shrinks while events are arriving, and grows while the
+    log group is idle or the API is throttling.
+    """
+    def __init__(self, client, log_group_name, events=None, rule_name=None, filter_pattern=None, start_time=None):
+        self.client = client
+        self.log_group_name = log_group_name
+        self.rule_name = rule_name
+        self.filter_pattern = filter_pattern
+        self.interval = log_poll_min_interval
+        self.boundary = 0
+        self.boundary_keys = set()
+        if events:
+            self.__remember(events)
+        else:
+            self.boundary = start_time or int(time.time() * 1000)
+
+    def poll(self):
+        filter_args = {
+            'logGroupName': self.log_group_name,
+            'startTime': self.boundary
+        }
+        if self.filter_pattern:
+            filter_args['filterPattern'] = self.filter_pattern
+        new_events = []
+        try:
+            while True:
+                response = self.client.filter_log_events(**filter_args)
+                new_events.extend(event for event in response['events'] if 'timestamp' in event and not self.__is_seen(event))
+                if not response.get('nextToken'):
+                    break
+                filter_args['nextToken'] = response['nextToken']
+        except ClientError as e:
+            #A rule that has never run has no log group yet, which is the same as a group with no new events.
+            if e.response['Error']['Code'] not in ['ThrottlingException', 'ResourceNotFoundException']:
+                raise
+            #Leave the partly read pages for the next poll, which starts from the same place.
+            self.interval = min(self.interval * log_poll_backoff, log_poll_max_interval)
+            return []
+
+        new_events.sort(key=lambda event: event['timestamp'])
+        self.__remember(new_events)
+        for event in new_events:
+            tag_log_event(event, self.log_group_name, event.get('logStreamName'), self.rule_name)
+        if new_events:
+            self.interval = log_poll_min_interval
+        else:
+            self.interval = min(self.interval * log_poll_backoff, log_poll_max_interval)
+        return new_events
+
+    def __is_seen(self, event):
+        return event['timestamp'] == self.boundary and (event.get('eventId') in self.boundary_keys or (event['timestamp'], event['message']) in self.boundary_keys)
+
+    def __remember(self, events):
+        #Events from get_log_events have no eventId, so events are also recognized by their timestamp and message.
+        for event in events:
+            if event['timestamp'] > self.boundary:
+                self.boundary = event['timestamp']
+                self.boundary_keys = set()
+            if event['timestamp'] == self.boundary:
+                if event.get('eventId'):
+                    self.boundary_keys.add(event['eventId'])
+                self.boundary_keys.add((event['timestamp'], event['message']))
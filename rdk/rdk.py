@@ -13,16 +13,34 @@ import shutil
 import boto3
 import json
 import time
-import imp
 import argparse
 from botocore.exceptions import ClientError
 from datetime import datetime
 import base64
+import re
+from boto3.s3.transfer import TransferConfig
 import ast
 import textwrap
 import fileinput
 import subprocess
 from subprocess import call
+import hashlib
+import io
+import stat
+import zipfile
+import threading
+import multiprocessing
+import collections
+import gzip
+from multiprocessing.pool import ThreadPool
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from .deploy import build_commands, run_rule_build, DeployPipeline
+from .cfn import CfnTemplateLocalizer, CfnStackTracker
+from .testing import get_worker_context, init_ci_stream_worker, evaluate_ci_batch, benchmark_rule, build_test_event, percentile, LocalTestRunner, TestCIFixtures
+from .logs import log_report_metrics, parse_log_time, parse_log_metrics, tag_log_event, merge_log_events, LogRenderer, LogArchive, LogTailer
 
 
 rdk_dir = '.rdk'
@@ -39,11 +57,58 @@ code_bucket_prefix = 'config-rule-code-bucket-'
 parameter_file_name = 'parameters.json'
 example_ci_dir = 'example_ci'
 test_ci_filename = 'test_ci.json'
+test_ci_dirname = 'test_ci'
+test_ci_extensions = ['.json', '.jsonl', '.ndjson']
+test_ci_index_filename = 'test_ci_index.json'
 event_template_filename = 'test_event_template.json'
+deploy_manifest_filename = 'deploy_manifest.json'
+build_manifest_filename = 'build_manifest.json'
+package_exclude_dirs = ['build', 'bin', 'obj', '__pycache__', '.gradle', test_ci_dirname]
+package_exclude_extensions = ['.zip', '.pyc']
+package_timestamp = (1980, 1, 1, 0, 0, 0)
+log_fetch_concurrency = 8
+log_archive_filename = 'logs.db'
+log_sync_overlap = 5 * 60 * 1000
+log_metrics_default_period = 24 * 60 * 60
+log_metrics_filter_pattern = '?REPORT ?"_aws"'
+cache_filename = 'cache.json'
+package_checksum_metadata_key = 'rdk-sha256'
+upload_multipart_threshold = 16 * 1024 * 1024
+upload_multipart_chunksize = 16 * 1024 * 1024
+upload_max_concurrency = 4
+cfn_max_template_body_size = 51200
+cfn_max_resources = 500
+combined_template_prefix = 'rdk-stacks/'
+util_layer_prefix = 'RDK-Rule-Util-'
+python_runtimes = ['python2.7', 'python3.6']
+util_layer_dir = 'python'
+sweep_log_days = 7
+test_ci_timeout = 30
+stream_batch_size = 500
+stream_progress_interval = 10
+benchmark_iterations = 100
+benchmark_warmup = 10
+benchmark_regression_threshold = 10
 
 class rdk():
     def __init__(self, args):
         self.args = args
+        self.__print_lock = threading.Lock()
+        self.__manifest_lock = threading.Lock()
+        self.__skipped_rules = []
+        self.__stack_tracker = None
+        self.__stack_tracker_lock = threading.Lock()
+        self.__session = None
+        self.__clients = {}
+        self.__account_id = None
+        self.__lambda_arns = {}
+        self.__session_lock = threading.Lock()
+        self.__cache_lock = threading.Lock()
+        self.__util_layers = {}
+        self.__util_layer_lock = threading.Lock()
+        self.__prefix_output = False
+        self.__build_pool = None
+        self.__stack_slots = None
 
     def process_command(self):
         method_to_call = getattr(self, self.args.command.replace('-','_'))
@@ -72,12 +137,10 @@ class rdk():
         my_session = self.__get_boto_session()
 
         #Create our ConfigService client
-        my_config = my_session.client('config')
+        my_config = self.__get_client('config')
 
         #get accountID
-        my_sts = my_session.client('sts')
-        response = my_sts.get_caller_identity()
-        account_id = response['Account']
+        account_id = self.__get_account_id()
 
         config_recorder_exists = False
         config_recorder_name = "default"
@@ -101,7 +164,7 @@ class rdk():
             print("Found Bucket: " + config_bucket_name)
             config_bucket_exists = True
 
-        my_s3 = my_session.client('s3')
+        my_s3 = self.__get_client('s3')
 
         if not config_bucket_exists:
             #create config bucket
@@ -123,7 +186,7 @@ class rdk():
 
         if not config_role_arn:
             #create config role
-            my_iam = my_session.client('iam')
+            my_iam = self.__get_client('iam')
             response = my_iam.list_roles()
             role_exists = False
             for role in response['Roles']:
@@ -207,6 +270,10 @@ class rdk():
         if not self.args.maximum_frequency:
             self.args.maximum_frequency = "TwentyFour_Hours"
 
+        if self.args.periodic_sweep and self.args.runtime not in python_runtimes:
+            print("Periodic sweeps are only supported for the " + " and ".join(python_runtimes) + " runtimes.")
+            return 1
+
         #create rule directory.
         rule_path = os.path.join(os.getcwd(), rules_dir, self.args.rulename)
         if os.path.exists(rule_path):
@@ -267,6 +334,13 @@ class rdk():
         if not self.args.input_parameters and old_params['Parameters']['InputParameters']:
             self.args.input_parameters = old_params['Parameters']['InputParameters']
 
+        if self.args.periodic_sweep is None:
+            self.args.periodic_sweep = old_params['Parameters'].get('PeriodicSweep') == 'true'
+
+        if self.args.periodic_sweep and self.args.runtime not in python_runtimes:
+            print("Periodic sweeps are only supported for the " + " and ".join(python_runtimes) + " runtimes.")
+            return 1
+
         #Write the parameters to a file in the rule directory.
         self.__write_params_file()
 
@@ -276,132 +350,284 @@ class rdk():
         parser = argparse.ArgumentParser(prog='rdk deploy')
         parser.add_argument('rulename', metavar='<rulename>', nargs='*', help='Rule name(s) to deploy.  Rule(s) will be pushed to AWS.')
         parser.add_argument('--all','-a', action='store_true', help="All rules in the working directory will be deployed.")
+        parser.add_argument('--concurrency','-c', type=int, default=1, help="[optional] Number of rules to deploy in parallel.  Defaults to 1.")
+        parser.add_argument('--force','-f', action='store_true', help="[optional] Build and deploy rules even if their code and parameters have not changed since the last deploy.")
+        parser.add_argument('--build-concurrency', type=int, help="[optional] Number of java8 or dotnetcore1.0 builds to run in parallel.  Defaults to the deploy concurrency.")
+        parser.add_argument('--util-layer', action='store_true', help="[optional] Publish rule_util as a shared Lambda Layer for each runtime instead of packaging a copy with every rule.")
+        parser.add_argument('--stack-name', help="[optional] Deploy the selected rules together in one CloudFormation stack with this name, instead of one stack per rule.")
+        parser.add_argument('--prune', action='store_true', help="[optional] With --stack-name, remove rules that are in the stack but were not selected for this deploy.  By default they are kept as they were last deployed.")
         self.args = parser.parse_args(self.args.command_args, self.args)
 
+        if self.args.concurrency < 1:
+            print("Concurrency must be at least 1.")
+            return 1
+
         #run the deploy code
         print ("Running deploy!")
 
         rule_names = self.__get_rule_list_for_command()
 
-        #create custom session based on whatever credentials are available to us
-        my_session = self.__get_boto_session()
-
         #get accountID
-        my_sts = my_session.client('sts')
-        response = my_sts.get_caller_identity()
-        account_id = response['Account']
+        account_id = self.__get_account_id()
+
+        results = {}
+        all_deploys = []
+        my_deploys = []
+        deployed_hashes = self.__read_manifest(deploy_manifest_filename)
         for rule_name in rule_names:
-            my_rule_params = self.__get_rule_parameters(rule_name)
-            s3_src = ""
-
-            if my_rule_params['SourceRuntime'] == "java8":
-                #Do java build and package.
-                print ("Running Gradle Build for "+rule_name)
-                working_dir = os.path.join(os.getcwd(), rules_dir, rule_name)
-                command = ["gradle","build"]
-                subprocess.call( command, cwd=working_dir)
-
-                #set source as distribution zip
-                s3_src = os.path.join(os.getcwd(), rules_dir, rule_name, 'build', 'distributions', rule_name+".zip")
-            elif my_rule_params['SourceRuntime'] == "dotnetcore1.0":
-                print ("Packaging "+rule_name)
-                working_dir = os.path.join(os.getcwd(), rules_dir, rule_name)
-                commands = [["dotnet","restore"]]
-                commands.append(["dotnet","lambda","package","-c","Release","-f","netcoreapp1.0"])
-
-                for command in commands:
-                    subprocess.call( command, cwd=working_dir)
-
-                s3_src_dir = os.path.join(os.getcwd(),rules_dir, rule_name,'bin','Release', 'netcoreapp1.0', 'publish')
-                s3_src = shutil.make_archive(os.path.join(rule_name, rule_name), 'zip', s3_src_dir)
-            else:
-                print ("Zipping " + rule_name)
-                #zip rule code files and upload to s3 bucket
-                s3_src_dir = os.path.join(os.getcwd(), rules_dir, rule_name)
-                s3_src = shutil.make_archive(os.path.join(rule_name, rule_name), 'zip', s3_src_dir)
-
-            s3_dst = os.path.join(rule_name, rule_name+".zip")
-            code_bucket_name = code_bucket_prefix + account_id + my_session.region_name
-            my_s3 = my_session.resource('s3')
-
-            print ("Uploading " + rule_name)
-            my_s3.meta.client.upload_file(s3_src, code_bucket_name, s3_dst)
-
-            #create CFN Parameters
-            my_params = [
-                {
-                    'ParameterKey': 'SourceBucket',
-                    'ParameterValue': code_bucket_name,
-                },
-                {
-                    'ParameterKey': 'SourcePath',
-                    'ParameterValue': s3_dst,
-                },
-                {
-                    'ParameterKey': 'SourceRuntime',
-                    'ParameterValue': my_rule_params['SourceRuntime'],
-                },
-                {
-                    'ParameterKey': 'SourceEvents',
-                    'ParameterValue': my_rule_params['SourceEvents'],
-                },
-                {
-                    'ParameterKey': 'SourcePeriodic',
-                    'ParameterValue': my_rule_params['SourcePeriodic'],
-                },
-                {
-                    'ParameterKey': 'SourceInputParameters',
-                    'ParameterValue': my_rule_params['InputParameters'],
-                },
-                {
-                    'ParameterKey': 'SourceHandler',
-                    'ParameterValue': self.__get_handler(rule_name, my_rule_params)
-                }]
-
-            #deploy config rule
-            cfn_body = os.path.join(os.getcwd(), rdk_dir, "configRole.json")
-            my_cfn = my_session.client('cloudformation')
+            my_deploy = self.__plan_rule_deploy(rule_name, account_id)
+            all_deploys.append(my_deploy)
 
-            try:
-                my_stack = my_cfn.describe_stacks(StackName=rule_name)
-                #If we've gotten here, stack exists and we should update it.
-                print ("Updating CloudFormation Stack for " + rule_name)
-                try:
-                    response = my_cfn.update_stack(
-                        StackName=rule_name,
-                        TemplateBody=open(cfn_body, "r").read(),
-                        Parameters=my_params,
-                        Capabilities=[
-                            'CAPABILITY_IAM',
-                        ],
-                    )
-                except ClientError as e:
-                    if e.response['Error']['Code'] == 'ValidationError':
-                        if 'No updates are to be performed.' in str(e):
-                            #No changes made to Config rule definition, so CloudFormation won't do anything.
-                            print("No changes to Config Rule.")
-                        else:
-                            #Something unexpected has gone wrong.  Emit an error and bail.
-                            print(e)
-                            return 1
-                    else:
-                        raise
+            #Skip rules whose code, parameters, and template are unchanged since the last successful deploy.
+            if not self.args.force and deployed_hashes.get(rule_name) == my_deploy['rule_hash']:
+                print("No changes to " + rule_name + " since last deploy, skipping.  Use --force to deploy anyway.")
+                self.__skipped_rules.append(rule_name)
+                results[rule_name] = None
+                continue
 
-                my_lambda_arn = self.__get_lambda_arn_for_rule(rule_name)
+            my_deploys.append(my_deploy)
 
-                print("Publishing Lambda code...")
-                my_lambda_client = my_session.client('lambda')
-                my_lambda_client.update_function_code(
-                    FunctionName=my_lambda_arn,
-                    S3Bucket=code_bucket_name,
-                    S3Key=s3_dst,
-                    Publish=True
+        if self.args.prune and not self.args.stack_name:
+            print("--prune can only be used with --stack-name.")
+            return 1
+
+        if self.args.stack_name:
+            return self.__deploy_combined_stack(rule_names, all_deploys, my_deploys, results)
+
+        #Every stage has its own workers, so the next rule can be built, packaged and uploaded while CloudFormation works on this one.
+        #Only --concurrency stack operations are in flight at once; a rule holds its slot from stack apply until the wait is over.
+        concurrency = max(min(self.args.concurrency, len(my_deploys)), 1)
+        self.__stack_slots = threading.BoundedSemaphore(concurrency)
+        stages = self.__get_upload_stages(my_deploys, concurrency) + [
+            ('stack apply', self.__apply_rule_stack, concurrency),
+            ('wait', self.__wait_for_rule_stack, concurrency),
+            ('code publish', self.__publish_rule, concurrency)
+        ]
+        if len(my_deploys) > 1:
+            print ("Deploying " + str(len(my_deploys)) + " rules with concurrency " + str(concurrency))
+
+        results.update(self.__run_deploy_pipeline(stages, my_deploys))
+
+        return self.__print_deploy_summary(rule_names, results)
+
+    def __plan_rule_deploy(self, rule_name, account_id):
+        #Gather everything about a rule that the deploy stages need.
+        my_session = self.__get_boto_session()
+        my_rule_params = self.__get_rule_parameters(rule_name)
+
+        s3_dst = os.path.join(rule_name, rule_name+".zip")
+        code_bucket_name = code_bucket_prefix + account_id + my_session.region_name
+
+        #Only the rule code itself needs to go into the package.
+        package_excludes = [parameter_file_name, test_ci_filename]
+
+        #With --util-layer, rule_util comes from a shared layer rather than the rule's own copy.
+        layer_arns = ""
+        if self.args.util_layer:
+            if my_rule_params['SourceRuntime'] in python_runtimes:
+                layer_arns = self.__get_util_layer(my_rule_params['SourceRuntime'])
+                package_excludes.append(util_filename + '.py')
+            else:
+                print("The rule_util layer is not supported for the " + my_rule_params['SourceRuntime'] + " runtime, so " + rule_name + " will be packaged with its own copy.")
+
+        #create CFN Parameters
+        my_params = self.__get_cfn_parameters(rule_name, my_rule_params, code_bucket_name, s3_dst, layer_arns)
+
+        return {
+            'rule_name': rule_name,
+            'rule_params': my_rule_params,
+            's3_dst': s3_dst,
+            'code_bucket_name': code_bucket_name,
+            'cfn_params': my_params,
+            'package_excludes': package_excludes,
+            'rule_hash': self.__get_rule_hash(rule_name, my_params, package_excludes)
+        }
+
+    def __get_util_layer(self, runtime):
+        #Each runtime's layer is published at most once per run, however many rules use it.
+        with self.__util_layer_lock:
+            if runtime not in self.__util_layers:
+                self.__util_layers[runtime] = self.__publish_util_layer(runtime)
+
+            return self.__util_layers[runtime]
+
+    def __publish_util_layer(self, runtime):
+        util_path = os.path.join(os.getcwd(), rdk_dir, 'runtime', runtime, util_filename + '.py')
+        layer_name = util_layer_prefix + runtime.replace('.', '_')
+
+        my_layer = io.BytesIO()
+        with zipfile.ZipFile(my_layer, 'w', zipfile.ZIP_DEFLATED) as layer_zip:
+            zip_info = zipfile.ZipInfo(util_layer_dir + '/' + util_filename + '.py', package_timestamp)
+            zip_info.compress_type = zipfile.ZIP_DEFLATED
+            zip_info.external_attr = (stat.S_IFREG | 0o644) << 16
+            with open(util_path, 'rb') as util_file:
+                layer_zip.writestr(zip_info, util_file.read())
+
+        #The layer description carries the checksum of its contents, so an unchanged rule_util reuses the latest version.
+        layer_description = "rdk rule_util sha256:" + hashlib.sha256(my_layer.getvalue()).hexdigest()
+        my_lambda_client = self.__get_client('lambda')
+        response = my_lambda_client.list_layer_versions(LayerName=layer_name, MaxItems=1)
+        for layer_version in response.get('LayerVersions', []):
+            if layer_version.get('Description') == layer_description:
+                print("Using existing " + layer_name + " layer version " + str(layer_version['Version']))
+                return layer_version['LayerVersionArn']
+
+        print("Publishing " + layer_name + " layer")
+        response = my_lambda_client.publish_layer_version(
+            LayerName=layer_name,
+            Description=layer_description,
+            Content={'ZipFile': my_layer.getvalue()},
+            CompatibleRuntimes=[runtime]
+        )
+        return response['LayerVersionArn']
+
+    def __get_upload_stages(self, my_deploys, concurrency):
+        #The stages that take a rule from source to a package in S3, shared by per-rule and combined stack deploys.
+        build_count = len([my_deploy for my_deploy in my_deploys if my_deploy['rule_params']['SourceRuntime'] in build_commands])
+        build_concurrency = max(min(self.args.build_concurrency or concurrency, build_count), 1)
+
+        return [
+            ('build', self.__build_rule, build_concurrency),
+            ('package', self.__package_rule, concurrency),
+            ('upload', self.__upload_rule_package, concurrency)
+        ]
+
+    def __run_deploy_pipeline(self, stages, my_deploys):
+        #Returns a dict of rule name to error message, or None for each rule that made it through every stage.
+        if not my_deploys:
+            return {}
+
+        #Compiled runtimes are built in a process pool, so that several builds can run at once.
+        build_count = len([my_deploy for my_deploy in my_deploys if my_deploy['rule_params']['SourceRuntime'] in build_commands])
+        if build_count:
+            build_concurrency = dict((name, workers) for name, function, workers in stages)['build']
+            print("Building " + str(build_count) + " rules with concurrency " + str(build_concurrency))
+            self.__build_pool = multiprocessing.Pool(build_concurrency)
+
+        self.__prefix_output = len(my_deploys) > 1
+        pipeline = DeployPipeline(stages, self.__print_rule)
+        try:
+            results = pipeline.run(my_deploys, lambda my_deploy: my_deploy['rule_name'])
+        finally:
+            if self.__build_pool:
+                self.__build_pool.close()
+                self.__build_pool.join()
+                self.__build_pool = None
+
+        pipeline.print_timings()
+        return results
+
+    def __build_rule(self, my_deploy):
+        rule_name = my_deploy['rule_name']
+        runtime = my_deploy['rule_params']['SourceRuntime']
+        if runtime not in build_commands:
+            return None
+
+        #Skip the build if the sources and build files are unchanged and the artifact from the last build is still there.
+        working_dir = os.path.join(os.getcwd(), rules_dir, rule_name)
+        source_hash = self.__hash_files(working_dir, hashlib.sha256(), [parameter_file_name]).hexdigest()
+        if not self.args.force and self.__read_manifest(build_manifest_filename).get(rule_name) == source_hash and os.path.exists(self.__get_build_artifact(rule_name, runtime)):
+            self.__print_rule(rule_name, "Build for " + rule_name + " is up to date.")
+            return None
+
+        self.__print_rule(rule_name, "Building " + rule_name)
+        rule_name, return_code, output, duration = self.__build_pool.apply(run_rule_build, (rule_name, runtime, working_dir))
+        if return_code != 0:
+            self.__print_rule(rule_name, "Build for " + rule_name + " failed with exit code " + str(return_code) + ":\n" + output)
+            return "Build failed with exit code " + str(return_code)
+
+        self.__print_rule(rule_name, "Built " + rule_name + " in " + "{0:.1f}".format(duration) + " seconds.")
+        self.__update_manifest(build_manifest_filename, rule_name, source_hash)
+        return None
+
+    def __get_build_artifact(self, rule_name, runtime):
+        if runtime == "java8":
+            return os.path.join(os.getcwd(), rules_dir, rule_name, 'build', 'distributions', rule_name+".zip")
+        return os.path.join(os.getcwd(), rules_dir, rule_name, 'bin', 'Release', 'netcoreapp1.0', 'publish')
+
+    def __package_rule(self, my_deploy):
+        rule_name = my_deploy['rule_name']
+        my_rule_params = my_deploy['rule_params']
+
+        if my_rule_params['SourceRuntime'] == "java8":
+            #Gradle builds the distribution zip itself, so just load it.
+            s3_src = self.__get_build_artifact(rule_name, "java8")
+            with open(s3_src, 'rb') as package_file:
+                my_package = io.BytesIO(package_file.read())
+            file_count = len(zipfile.ZipFile(my_package).namelist())
+        elif my_rule_params['SourceRuntime'] == "dotnetcore1.0":
+            self.__print_rule(rule_name, "Packaging "+rule_name)
+            s3_src_dir = self.__get_build_artifact(rule_name, "dotnetcore1.0")
+            my_package, file_count = self.__build_package(s3_src_dir)
+        else:
+            self.__print_rule(rule_name, "Zipping " + rule_name)
+            #zip rule code files and upload to s3 bucket
+            s3_src_dir = os.path.join(os.getcwd(), rules_dir, rule_name)
+            my_package, file_count = self.__build_package(s3_src_dir, my_deploy['package_excludes'])
+
+        self.__print_rule(rule_name, "Packaged " + rule_name + ": " + str(file_count) + " files, " + str(len(my_package.getvalue())) + " bytes")
+
+        my_package.seek(0)
+        my_deploy['package'] = my_package
+        return None
+
+    def __upload_rule_package(self, my_deploy):
+        rule_name = my_deploy['rule_name']
+        my_package = my_deploy['package']
+        s3_dst = my_deploy['s3_dst']
+        code_bucket_name = my_deploy['code_bucket_name']
+
+        #Only upload the package if S3 doesn't already hold an identical copy.
+        package_checksum = hashlib.sha256(my_package.getvalue()).hexdigest()
+        if self.__is_package_uploaded(code_bucket_name, s3_dst, package_checksum):
+            self.__print_rule(rule_name, "Package for " + rule_name + " is already in S3, skipping upload.")
+        else:
+            self.__print_rule(rule_name, "Uploading " + rule_name)
+            self.__get_client('s3').upload_fileobj(
+                my_package,
+                code_bucket_name,
+                s3_dst,
+                ExtraArgs={'Metadata': {package_checksum_metadata_key: package_checksum}},
+                Config=TransferConfig(
+                    multipart_threshold=upload_multipart_threshold,
+                    multipart_chunksize=upload_multipart_chunksize,
+                    max_concurrency=upload_max_concurrency
                 )
-                print("Lambda code updated.")
-            except ClientError as e:
-                #If we're in the exception, the stack does not exist and we should create it.
-                print ("Creating CloudFormation Stack for " + rule_name)
-                response = my_cfn.create_stack(
+            )
+
+        return None
+
+    def __apply_rule_stack(self, my_deploy):
+        #The stack slot is released here if the operation never starts, otherwise by the wait stage.
+        self.__stack_slots.acquire()
+        error = "CloudFormation stack operation was not started."
+        try:
+            error = self.__start_rule_stack_operation(my_deploy)
+        finally:
+            if error:
+                self.__stack_slots.release()
+
+        return error
+
+    def __start_rule_stack_operation(self, my_deploy):
+        rule_name = my_deploy['rule_name']
+        my_params = my_deploy['cfn_params']
+
+        #deploy config rule
+        cfn_body = os.path.join(os.getcwd(), rdk_dir, "configRole.json")
+        my_cfn = self.__get_client('cloudformation')
+
+        try:
+            my_cfn.describe_stacks(StackName=rule_name)
+            my_deploy['stack_exists'] = True
+        except ClientError:
+            my_deploy['stack_exists'] = False
+
+        if my_deploy['stack_exists']:
+            #If we've gotten here, stack exists and we should update it.
+            self.__print_rule(rule_name, "Updating CloudFormation Stack for " + rule_name)
+            try:
+                response = my_cfn.update_stack(
                     StackName=rule_name,
                     TemplateBody=open(cfn_body, "r").read(),
                     Parameters=my_params,
@@ -409,47 +635,751 @@ class rdk():
                         'CAPABILITY_IAM',
                     ],
                 )
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ValidationError':
+                    if 'No updates are to be performed.' in str(e):
+                        #No changes made to Config rule definition, so CloudFormation won't do anything.
+                        self.__print_rule(rule_name, "No changes to Config Rule.")
+                    else:
+                        #Something unexpected has gone wrong.  Emit an error and bail.
+                        self.__print_rule(rule_name, str(e))
+                        return str(e)
+                else:
+                    raise
+        else:
+            #The stack does not exist, so we should create it.
+            self.__print_rule(rule_name, "Creating CloudFormation Stack for " + rule_name)
+            response = my_cfn.create_stack(
+                StackName=rule_name,
+                TemplateBody=open(cfn_body, "r").read(),
+                Parameters=my_params,
+                Capabilities=[
+                    'CAPABILITY_IAM',
+                ],
+            )
 
-            #wait for changes to propagate.
-            self.__wait_for_cfn_stack(my_cfn, rule_name)
+        return None
 
-        print('Config deploy complete.')
+    def __wait_for_rule_stack(self, my_deploy):
+        rule_name = my_deploy['rule_name']
+
+        #wait for changes to propagate.
+        try:
+            my_stack = self.__wait_for_cfn_stack(rule_name)
+        finally:
+            self.__stack_slots.release()
+
+        if self.__is_failed_stack(my_stack):
+            return "CloudFormation stack operation finished with status " + my_stack['StackStatus']
 
+        #Remember the function's ARN for later commands.
+        my_deploy['lambda_arn'] = self.__get_lambda_arn_for_rule(rule_name, my_stack)
+        return None
+
+    def __publish_rule(self, my_deploy):
+        #Since CFN won't detect changes to the lambda code stored in S3 as a reason to update the stack, we need to manually update the code reference in Lambda once the CFN has run.
+        #New functions are created from the uploaded code, so they are already current.
+        if my_deploy['stack_exists']:
+            self.__publish_rule_code(my_deploy, my_deploy['lambda_arn'])
+
+        self.__update_manifest(deploy_manifest_filename, my_deploy['rule_name'], my_deploy['rule_hash'])
+        return None
+
+    def __publish_rule_code(self, my_deploy, my_lambda_arn):
+        rule_name = my_deploy['rule_name']
+
+        #Lambda reports the base64 SHA-256 of the deployed package, so we can tell if the function is already running this code.
+        my_lambda_client = self.__get_client('lambda')
+        code_sha256 = base64.b64encode(hashlib.sha256(my_deploy['package'].getvalue()).digest()).decode('utf-8')
+        if my_lambda_client.get_function_configuration(FunctionName=my_lambda_arn).get('CodeSha256') == code_sha256:
+            self.__print_rule(rule_name, "Lambda code is already up to date.")
+        else:
+            self.__print_rule(rule_name, "Publishing Lambda code...")
+            my_lambda_client.update_function_code(
+                FunctionName=my_lambda_arn,
+                S3Bucket=my_deploy['code_bucket_name'],
+                S3Key=my_deploy['s3_dst'],
+                Publish=True
+            )
+            self.__print_rule(rule_name, "Lambda code updated.")
+
+    def __deploy_combined_stack(self, rule_names, all_deploys, my_deploys, results):
+        #One stack holds every selected rule, so rules are packaged individually but go out in a single stack operation.
+        stack_name = self.args.stack_name
+        manifest_key = 'stack/' + stack_name
+        deployed_template = self.__get_deployed_template(stack_name)
+        kept_rules = self.__get_combined_stack_rules(deployed_template)
+
+        #Rules joining the stack would clash with their own stack's Lambda function and Config rule, so check before changing anything.
+        new_rules = [my_deploy['rule_name'] for my_deploy in all_deploys if self.__get_logical_id_suffix(my_deploy['rule_name']) not in kept_rules]
+        clashing_rules = [rule_name for rule_name in new_rules if self.__stack_exists(rule_name)]
+        if clashing_rules:
+            print("Not updating stack " + stack_name + " because these rules already have their own stacks: " + ", ".join(clashing_rules) + ".  Delete those stacks first.")
+            for rule_name in rule_names:
+                results[rule_name] = "Rule already has its own stack." if rule_name in clashing_rules else "Stack " + stack_name + " was not updated."
+            return self.__print_deploy_summary(rule_names, results)
+
+        concurrency = max(min(self.args.concurrency, len(my_deploys)), 1)
+        results.update(self.__run_deploy_pipeline(self.__get_upload_stages(my_deploys, concurrency), my_deploys))
+
+        #Every rule in the stack has to be present in the template, otherwise CloudFormation would delete it.
+        if [rule_name for rule_name in rule_names if results.get(rule_name)]:
+            print("Not updating stack " + stack_name + " because some rules could not be built or uploaded.")
+            return self.__print_deploy_summary(rule_names, results)
+
+        #Rules already in the stack that were not selected are carried over from the deployed template, unless they are being pruned.
+        for my_deploy in all_deploys:
+            kept_rules.pop(self.__get_logical_id_suffix(my_deploy['rule_name']), None)
+        if kept_rules and self.args.prune:
+            print("Removing " + ", ".join(sorted(kept_rules.values())) + " from stack " + stack_name + ".")
+            kept_rules = {}
+        elif kept_rules:
+            print("Keeping " + ", ".join(sorted(kept_rules.values())) + " in stack " + stack_name + " as last deployed.  Use --prune to remove them.")
+
+        my_template = self.__build_combined_template(all_deploys, deployed_template, kept_rules)
+        template_body = json.dumps(my_template, indent=2, sort_keys=True)
+        stack_hash = hashlib.sha256(template_body.encode('utf-8')).hexdigest()
+        if not self.args.force and not my_deploys and self.__read_manifest(deploy_manifest_filename).get(manifest_key) == stack_hash:
+            print("No changes to stack " + stack_name + " since last deploy, skipping.")
+            return self.__print_deploy_summary(rule_names, results)
+
+        try:
+            error = self.__apply_combined_stack(stack_name, template_body, my_deploys)
+        except (Exception, SystemExit) as e:
+            error = str(e) or e.__class__.__name__
+            print("Error during deploy: " + error)
+
+        if error:
+            for my_deploy in all_deploys:
+                results[my_deploy['rule_name']] = error
+        else:
+            self.__update_manifest(deploy_manifest_filename, manifest_key, stack_hash)
+            for my_deploy in all_deploys:
+                self.__update_manifest(deploy_manifest_filename, my_deploy['rule_name'], my_deploy['rule_hash'])
+
+        return self.__print_deploy_summary(rule_names, results)
+
+    def __apply_combined_stack(self, stack_name, template_body, my_deploys):
+        my_cfn = self.__get_client('cloudformation')
+        template_args = {'Capabilities': ['CAPABILITY_IAM']}
+
+        #Large templates have to be passed to CloudFormation through S3.
+        if len(template_body) > cfn_max_template_body_size:
+            code_bucket_name = code_bucket_prefix + self.__get_account_id() + self.__get_boto_session().region_name
+            template_key = combined_template_prefix + stack_name + '.json'
+            self.__get_client('s3').put_object(Bucket=code_bucket_name, Key=template_key, Body=template_body.encode('utf-8'))
+            template_args['TemplateURL'] = "https://" + code_bucket_name + ".s3." + self.__get_boto_session().region_name + ".amazonaws.com/" + template_key
+        else:
+            template_args['TemplateBody'] = template_body
+
+        try:
+            my_cfn.describe_stacks(StackName=stack_name)
+            stack_exists = True
+        except ClientError:
+            stack_exists = False
+
+        if stack_exists:
+            print("Updating CloudFormation Stack " + stack_name)
+            try:
+                my_cfn.update_stack(StackName=stack_name, **template_args)
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ValidationError' and 'No updates are to be performed.' in str(e):
+                    print("No changes to Config Rules.")
+                else:
+                    print(e)
+                    return str(e)
+        else:
+            print("Creating CloudFormation Stack " + stack_name)
+            my_cfn.create_stack(StackName=stack_name, **template_args)
+
+        my_stack = self.__wait_for_cfn_stack(stack_name)
+        if self.__is_failed_stack(my_stack):
+            return "CloudFormation stack operation finished with status " + my_stack['StackStatus']
+
+        #New functions are created from the uploaded code, but existing functions need their code updated directly.
+        cfn_outputs = dict((output['OutputKey'], output['OutputValue']) for output in my_stack.get('Outputs', []))
+        for my_deploy in my_deploys:
+            output_key = 'RuleCodeLambda' + self.__get_logical_id_suffix(my_deploy['rule_name'])
+            if output_key not in cfn_outputs:
+                return "Could not read CloudFormation stack output to find Lambda function for " + my_deploy['rule_name'] + "."
+            if stack_exists:
+                self.__publish_rule_code(my_deploy, cfn_outputs[output_key])
+
+        return None
+
+    def __stack_exists(self, stack_name):
+        try:
+            self.__get_client('cloudformation').describe_stacks(StackName=stack_name)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ValidationError':
+                return False
+            raise
+        return True
+
+    def __get_deployed_template(self, stack_name):
+        try:
+            template_body = self.__get_client('cloudformation').get_template(StackName=stack_name)['TemplateBody']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ValidationError':
+                return None
+            raise
+
+        #boto3 parses JSON templates, but hand back a string if it didn't.
+        if not isinstance(template_body, dict):
+            template_body = json.loads(template_body)
+        return template_body
+
+    def __get_combined_stack_rules(self, deployed_template):
+        #Returns the rules in a combined stack, keyed by their logical ID suffix.
+        if not deployed_template:
+            return {}
+        if 'RdkRules' in deployed_template.get('Metadata', {}):
+            return dict(deployed_template['Metadata']['RdkRules'])
+
+        #Stacks deployed before the rule names were recorded still have an output for each rule's Lambda function.
+        output_prefix = 'RuleCodeLambda'
+        return dict((output_key[len(output_prefix):], output_key[len(output_prefix):]) for output_key in deployed_template.get('Outputs', {}) if output_key.startswith(output_prefix) and len(output_key) > len(output_prefix))
+
+    def __get_logical_id_suffix(self, rule_name):
+        #CloudFormation logical IDs may only contain letters and digits.
+        return re.sub('[^A-Za-z0-9]', '', rule_name)
+
+    def __build_combined_template(self, my_deploys, deployed_template=None, kept_rules=None):
+        with open(os.path.join(os.getcwd(), rdk_dir, "configRole.json"), 'r') as cfn_file:
+            rule_template = json.load(cfn_file)
+
+        kept_rules = kept_rules or {}
+        suffixes = dict(kept_rules)
+        rule_names = sorted([my_deploy['rule_name'] for my_deploy in my_deploys] + list(kept_rules.values()))
+        my_template = {
+            'AWSTemplateFormatVersion': rule_template['AWSTemplateFormatVersion'],
+            'Description': "AWS CloudFormation template for rdk rules: " + ", ".join(rule_names),
+            'Metadata': {'RdkRules': {}},
+            'Conditions': {},
+            'Resources': {},
+            'Outputs': {}
+        }
+
+        #Kept rules are copied unchanged from the deployed template, so they stay exactly as they were last deployed.
+        for suffix in kept_rules:
+            for section in ['Conditions', 'Resources', 'Outputs']:
+                for logical_id, body in deployed_template.get(section, {}).items():
+                    base_id = logical_id[:-len(suffix)]
+                    if logical_id.endswith(suffix) and base_id in rule_template.get(section, {}):
+                        my_template[section][logical_id] = body
+        for my_deploy in my_deploys:
+            rule_name = my_deploy['rule_name']
+            suffix = self.__get_logical_id_suffix(rule_name)
+            if suffix in suffixes:
+                raise Exception("Rules " + suffixes[suffix] + " and " + rule_name + " can't share a stack because their names only differ in punctuation.")
+            suffixes[suffix] = rule_name
+
+            #Parameters are resolved to this rule's values, and every logical ID gets the rule's suffix.
+            parameter_values = {}
+            for parameter_name, parameter in rule_template['Parameters'].items():
+                if 'Default' in parameter:
+                    parameter_values[parameter_name] = parameter['Default']
+            for parameter in my_deploy['cfn_params']:
+                parameter_values[parameter['ParameterKey']] = parameter['ParameterValue']
+            for parameter_name, parameter in rule_template['Parameters'].items():
+                if parameter['Type'] == 'CommaDelimitedList':
+                    parameter_values[parameter_name] = parameter_values[parameter_name].split(',')
+            parameter_values['AWS::StackName'] = rule_name
+
+            logical_ids = list(rule_template['Resources'].keys()) + list(rule_template.get('Conditions', {}).keys())
+            localizer = CfnTemplateLocalizer(parameter_values, logical_ids, suffix)
+
+            for section in ['Conditions', 'Resources', 'Outputs']:
+                for logical_id, body in rule_template.get(section, {}).items():
+                    my_template[section][logical_id + suffix] = localizer.localize(body)
+
+        my_template['Metadata']['RdkRules'] = suffixes
+
+        if len(my_template['Resources']) > cfn_max_resources:
+            raise Exception("A combined stack for these rules would have " + str(len(my_template['Resources'])) + " resources, more than the CloudFormation limit of " + str(cfn_max_resources) + ".  Deploy the rules as several smaller stacks.")
+
+        return my_template
+
+    def __get_cfn_parameters(self, rule_name, my_rule_params, code_bucket_name, s3_dst, layer_arns=""):
+        my_params = [
+            {
+                'ParameterKey': 'SourceBucket',
+                'ParameterValue': code_bucket_name,
+            },
+            {
+                'ParameterKey': 'SourcePath',
+                'ParameterValue': s3_dst,
+            },
+            {
+                'ParameterKey': 'SourceRuntime',
+                'ParameterValue': my_rule_params['SourceRuntime'],
+            },
+            {
+                'ParameterKey': 'SourceEvents',
+                'ParameterValue': my_rule_params['SourceEvents'],
+            },
+            {
+                'ParameterKey': 'SourcePeriodic',
+                'ParameterValue': my_rule_params['SourcePeriodic'],
+            },
+            {
+                'ParameterKey': 'SourceInputParameters',
+                'ParameterValue': my_rule_params['InputParameters'],
+            },
+            {
+                'ParameterKey': 'SourceHandler',
+                'ParameterValue': self.__get_handler(rule_name, my_rule_params)
+            }]
+
+        #Working directories initialized by older versions of rdk have a template without the SourceLayers parameter.
+        with open(os.path.join(os.getcwd(), rdk_dir, "configRole.json"), 'r') as cfn_file:
+            template_parameters = json.load(cfn_file)['Parameters']
+
+        if 'SourceLayers' in template_parameters:
+            my_params.append({
+                'ParameterKey': 'SourceLayers',
+                'ParameterValue': layer_arns
+            })
+        elif layer_arns:
+            raise Exception("The CloudFormation template in " + rdk_dir + " does not support layers.  Run `rdk init` to update it.")
+
+        periodic_sweep = my_rule_params.get('PeriodicSweep', 'false')
+        if 'SourcePeriodicSweep' in template_parameters:
+            my_params.append({
+                'ParameterKey': 'SourcePeriodicSweep',
+                'ParameterValue': periodic_sweep
+            })
+        elif periodic_sweep == 'true':
+            raise Exception("The CloudFormation template in " + rdk_dir + " does not support periodic sweeps.  Run `rdk init` to update it.")
+
+        return my_params
+
+    def __get_rule_hash(self, rule_name, my_params, package_excludes):
+        #Hash everything that goes into a deploy: the rule's packaged files, its CFN parameters, and the CFN template.
+        rule_path = os.path.join(os.getcwd(), rules_dir, rule_name)
+        rule_hash = self.__hash_files(rule_path, hashlib.sha256(), package_excludes)
+
+        rule_hash.update(json.dumps(my_params, sort_keys=True).encode('utf-8'))
+
+        #A rule deployed into a combined stack is a different deployment from the same rule in its own stack.
+        rule_hash.update(str(self.args.stack_name).encode('utf-8'))
+
+        with open(os.path.join(os.getcwd(), rdk_dir, "configRole.json"), 'rb') as cfn_file:
+            rule_hash.update(cfn_file.read())
+
+        return rule_hash.hexdigest()
+
+    def __hash_files(self, root_path, file_hash, exclude_files=[]):
+        for relative_path in self.__get_package_files(root_path):
+            if relative_path in exclude_files:
+                continue
+            file_hash.update(relative_path.replace(os.sep, '/').encode('utf-8'))
+            with open(os.path.join(root_path, relative_path), 'rb') as source_file:
+                file_hash.update(hashlib.sha256(source_file.read()).digest())
+
+        return file_hash
+
+    def __get_package_files(self, root_path):
+        #Walk a directory and return the relative paths of the files that should be packaged, in a stable order.
+        package_files = []
+        for dir_path, dir_names, file_names in os.walk(root_path):
+            dir_names[:] = sorted(d for d in dir_names if d not in package_exclude_dirs)
+            for file_name in sorted(file_names):
+                if os.path.splitext(file_name)[1] in package_exclude_extensions:
+                    continue
+                package_files.append(os.path.relpath(os.path.join(dir_path, file_name), root_path))
+
+        return package_files
+
+    def __is_package_uploaded(self, bucket_name, key, package_checksum):
+        try:
+            response = self.__get_client('s3').head_object(Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            #A missing object just means we upload, but other errors such as AccessDenied need to be seen.
+            if e.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+                return False
+            raise
+
+        return response.get('Metadata', {}).get(package_checksum_metadata_key) == package_checksum
+
+    def __build_package(self, root_path, exclude_files=[]):
+        #Build the zip in memory so that it never ends up inside the directory being zipped.
+        #Entries are written in sorted order with fixed timestamps and permissions, so identical inputs produce identical packages.
+        my_package = io.BytesIO()
+        package_files = [f for f in self.__get_package_files(root_path) if f not in exclude_files]
+        with zipfile.ZipFile(my_package, 'w', zipfile.ZIP_DEFLATED) as package_zip:
+            for relative_path in package_files:
+                file_path = os.path.join(root_path, relative_path)
+                zip_info = zipfile.ZipInfo(relative_path.replace(os.sep, '/'), package_timestamp)
+                zip_info.compress_type = zipfile.ZIP_DEFLATED
+                file_mode = 0o755 if os.stat(file_path).st_mode & stat.S_IXUSR else 0o644
+                zip_info.external_attr = (stat.S_IFREG | file_mode) << 16
+                with open(file_path, 'rb') as source_file:
+                    package_zip.writestr(zip_info, source_file.read())
+
+        my_package.seek(0)
+        return my_package, len(package_files)
+
+    def __read_manifest(self, manifest_filename):
+        manifest_path = os.path.join(os.getcwd(), rdk_dir, manifest_filename)
+        if not os.path.exists(manifest_path):
+            return {}
+
+        with open(manifest_path, 'r') as manifest_file:
+            return json.load(manifest_file)
+
+    def __update_manifest(self, manifest_filename, rule_name, rule_hash):
+        #Several rules may finish at the same time, so the read-modify-write is serialized.
+        with self.__manifest_lock:
+            my_manifest = self.__read_manifest(manifest_filename)
+            my_manifest[rule_name] = rule_hash
+            manifest_path = os.path.join(os.getcwd(), rdk_dir, manifest_filename)
+            with open(manifest_path, 'w') as manifest_file:
+                json.dump(my_manifest, manifest_file, indent=2, sort_keys=True)
+
+    def __print_deploy_summary(self, rule_names, results):
+        failed_rules = []
+        for rule_name in rule_names:
+            if results[rule_name] is not None:
+                failed_rules.append((rule_name, results[rule_name]))
+
+        if len(rule_names) > 1:
+            print("Deploy summary: " + str(len(rule_names) - len(failed_rules)) + " succeeded (" + str(len(self.__skipped_rules)) + " unchanged), " + str(len(failed_rules)) + " failed.")
+            for rule_name, error in failed_rules:
+                print("\tFAILED " + rule_name + ": " + error)
+
+        if failed_rules:
+            return 1
+
+        print('Config deploy complete.')
         return 0
 
     def test_local(self):
-        print ("Running test_local!")
         self.__parse_test_args()
-
-        #Dynamically import the shared rule_util module.
-        util_path = os.path.join(rdk_dir, "rule_util.py")
-        imp.load_source('rule_util', util_path)
+        self.__print_status("Running test_local!")
 
         #Construct our list of rules to test.
         rule_names = self.__get_rule_list_for_command()
 
+        rule_tests = []
         for rule_name in rule_names:
-            print("Testing "+rule_name)
-            #Dynamically import the custom rule code, so that we can run the evaluate_compliance function.
-            module_path = os.path.join(".", os.path.dirname(rules_dir), rule_name, rule_name+".py")
-            module_name = str(rule_name).lower()
-            module = imp.load_source(module_name, module_path)
+            rule_test = self.__get_rule_test(rule_name)
+            if rule_test:
+                rule_tests.append(rule_test)
 
-            #Get CI JSON from either the CLI or one of the stored templates.
-            my_cis = self.__get_test_CIs(rule_name)
+        if not rule_tests:
+            return 0
+
+        if self.args.ci_stream:
+            return self.__test_ci_stream(rule_tests)
+
+        #Each rule is loaded into a fresh worker process, so rules can't see each other's modules or share a Config client.
+        processes = max(min(self.args.processes or multiprocessing.cpu_count(), len(rule_tests)), 1)
+        print("Testing " + str(len(rule_tests)) + " rules in " + str(processes) + " worker processes")
+        start_time = time.time()
+        runner = LocalTestRunner(processes, self.args.timeout, self.__print_test_results)
+        all_results = runner.run(rule_tests)
+
+        ci_count = sum(len(rule_results) for rule_results in all_results.values())
+        error_count = sum(1 for rule_results in all_results.values() for result in rule_results if result['error'] and not result['timed_out'])
+        timeout_count = sum(1 for rule_results in all_results.values() for result in rule_results if result['timed_out'])
+        print("Test summary: " + str(len(rule_tests)) + " rules, " + str(ci_count) + " CIs in " + "{0:.1f}".format(time.time() - start_time) + " seconds.  " + str(error_count) + " errors, " + str(timeout_count) + " timed out.")
+
+        if error_count or timeout_count:
+            return 1
+
+        return 0
 
+    def __get_rule_test(self, rule_name):
+        #Gather everything a test worker needs to run a rule, or None if the rule can't be tested locally.
+        my_rule_params = self.__get_rule_parameters(rule_name)
+        if my_rule_params['SourceRuntime'] not in python_runtimes:
+            self.__print_status("Skipping " + rule_name + ": test-local only supports python rules.")
+            return None
+
+        #Rules carry their own copy of rule_util unless they were created to use the shared layer.
+        rule_path = os.path.join(os.getcwd(), rules_dir, rule_name)
+        util_path = os.path.join(rule_path, util_filename + '.py')
+        if not os.path.exists(util_path):
+            util_path = os.path.join(os.getcwd(), rdk_dir, 'runtime', my_rule_params['SourceRuntime'], util_filename + '.py')
+
+        return {
+            'rule_name': rule_name,
+            'module_path': os.path.join(rule_path, rule_name + ".py"),
+            'util_path': util_path,
+            #Get CI JSON from either the CLI or one of the stored templates.  Streamed CIs are read later.
+            'cis': [] if self.args.ci_stream else self.__get_test_CIs(rule_name),
             #Get Parameters from Rule config
-            my_rule_params = self.__get_rule_parameters(rule_name)
-            my_parameters = my_rule_params['InputParameters']
+            'parameters': my_rule_params['InputParameters'],
+            'source_events': [ci_type.strip() for ci_type in str(my_rule_params['SourceEvents']).split(',') if ci_type.strip()],
+            'region': self.args.region or self.__get_boto_session().region_name,
+            #With --invoke, the rule's Lambda handler is called with a Config event instead of calling evaluate_compliance directly.
+            'event_template': self.__read_test_event_template() if self.args.invoke else None,
+            'handler': self.__get_handler(rule_name, my_rule_params).split('.')[-1],
+            'lambda_settings': self.__get_lambda_settings()
+        }
 
-            #Execute the evaluate_compliance function
-            for my_ci in my_cis:
-                print ("\t\tTesting CI " + my_ci['resourceType'])
-                result = getattr(module, 'evaluate_compliance')(my_ci, my_parameters)
-                print("\t\t\t"+result)
+    def __read_test_event_template(self):
+        with open(os.path.join(os.getcwd(), rdk_dir, event_template_filename), 'r') as event_file:
+            return json.load(event_file, strict=False)
+
+    def __get_lambda_settings(self):
+        #The function settings a rule gets when deployed, so that a local invoke sees the same memory size and timeout.
+        with open(os.path.join(os.getcwd(), rdk_dir, "configRole.json"), 'r') as cfn_file:
+            lambda_properties = json.load(cfn_file)['Resources']['rdkRuleCodeLambda']['Properties']
+
+        return {'memory_size': int(lambda_properties.get('MemorySize', 128)), 'timeout': int(lambda_properties.get('Timeout', 3))}
+
+    def __test_ci_stream(self, rule_tests):
+        stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+        if self.args.ci_stream == '-':
+            ci_file = stdin
+        elif self.args.ci_stream.endswith('.gz'):
+            ci_file = gzip.open(self.args.ci_stream, 'rb')
+        else:
+            ci_file = open(self.args.ci_stream, 'rb')
+
+        output_file = sys.stdout
+        try:
+            if self.args.results_file and self.args.results_file != '-':
+                output_file = open(self.args.results_file, 'w')
+            return self.__evaluate_ci_stream(rule_tests, ci_file, output_file)
+        finally:
+            if output_file is not sys.stdout:
+                output_file.close()
+            if ci_file is not stdin:
+                ci_file.close()
+
+    def __evaluate_ci_stream(self, rule_tests, ci_file, output_file):
+        #CIs are read and evaluated a batch at a time, with only a few batches in flight, so memory use doesn't grow with the input.
+        batch_size = max(self.args.batch_size, 1)
+        processes = max(self.args.processes or multiprocessing.cpu_count(), 1)
+        self.__print_status("Streaming CIs to " + str(len(rule_tests)) + " rules in " + str(processes) + " worker processes, " + str(batch_size) + " CIs per batch")
+        #Workers record when they last finished a CI, so a rule that hangs is noticed after --timeout seconds however large the batches are.
+        worker_context = get_worker_context()
+        progress = worker_context.Value('d', time.time())
+        pool = worker_context.Pool(processes, init_ci_stream_worker, (rule_tests, progress))
+        counts = dict((rule_test['rule_name'], {}) for rule_test in rule_tests)
+        totals = {'cis': 0, 'evaluations': 0, 'invalid': 0}
+        pending_batches = collections.deque()
+        start_time = time.time()
+        next_progress = start_time + stream_progress_interval
+        try:
+            for batch in self.__read_ci_batches(ci_file, batch_size):
+                totals['cis'] = totals['cis'] + len(batch)
+                pending_batches.append((len(batch), pool.apply_async(evaluate_ci_batch, (batch,))))
+                #Time spent waiting for input doesn't count against the rules.
+                progress.value = time.time()
+                if len(pending_batches) >= processes * 2:
+                    self.__write_stream_results(pending_batches.popleft(), output_file, counts, totals, progress)
+
+                if time.time() > next_progress:
+                    next_progress = time.time() + stream_progress_interval
+                    self.__print_status("Read " + str(totals['cis']) + " CIs (" + "{0:.0f}".format(totals['cis'] / (time.time() - start_time)) + " CIs/sec)")
+
+            while pending_batches:
+                self.__write_stream_results(pending_batches.popleft(), output_file, counts, totals, progress)
+
+            pool.close()
+        except multiprocessing.TimeoutError:
+            self.__print_status("No CI finished evaluating in " + str(self.args.timeout) + " seconds, so a rule seems to be stuck.  Stopping.")
+            return 1
+        except Exception as e:
+            self.__print_status(str(e))
+            return 1
+        finally:
+            pool.terminate()
+            pool.join()
+
+        duration = time.time() - start_time
+        throughput = totals['cis'] / duration if duration else 0
+        output_file.write(json.dumps({'summary': {
+            'cis': totals['cis'],
+            'evaluations': totals['evaluations'],
+            'invalid': totals['invalid'],
+            'seconds': round(duration, 3),
+            'cisPerSecond': round(throughput, 1),
+            'compliance': counts
+        }}, sort_keys=True) + "\n")
+
+        self.__print_status("Evaluated " + str(totals['cis']) + " CIs (" + str(totals['evaluations']) + " evaluations) in " + "{0:.1f}".format(duration) + " seconds, " + "{0:.0f}".format(throughput) + " CIs/sec.  " + str(totals['invalid']) + " lines could not be parsed.")
+        for rule_name in sorted(counts):
+            self.__print_status("\t" + rule_name + ": " + ", ".join(compliance + " " + str(count) for compliance, count in sorted(counts[rule_name].items())))
+
+        if totals['invalid'] or [rule_counts for rule_counts in counts.values() if rule_counts.get('ERROR')]:
+            return 1
 
         return 0
 
+    def __read_ci_batches(self, ci_file, batch_size):
+        #Lines are handed to the workers unparsed, so the reading process only has to split the input.
+        batch = []
+        for line in ci_file:
+            if not line.strip():
+                continue
+            batch.append(line)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def __write_stream_results(self, pending_batch, output_file, counts, totals, progress):
+        batch_length, async_result = pending_batch
+        while True:
+            try:
+                records = async_result.get(1)
+                break
+            except multiprocessing.TimeoutError:
+                if time.time() - progress.value > self.args.timeout:
+                    raise
+
+        for record in records:
+            if 'rule' not in record:
+                totals['invalid'] = totals['invalid'] + 1
+            else:
+                totals['evaluations'] = totals['evaluations'] + 1
+                rule_counts = counts[record['rule']]
+                rule_counts[record['compliance']] = rule_counts.get(record['compliance'], 0) + 1
+            output_file.write(json.dumps(record, sort_keys=True, default=str) + "\n")
+
+    def __print_status(self, message):
+        #With --ci-stream or raw or json log output, stdout may be carrying the results, so status messages go to stderr.
+        if getattr(self.args, 'ci_stream', None) or getattr(self.args, 'output', 'text') != 'text':
+            with self.__print_lock:
+                sys.stderr.write(message + "\n")
+        else:
+            print(message)
+
+    def __print_test_results(self, rule_test, rule_results):
+        lines = ["Testing " + rule_test['rule_name']]
+        for my_ci, result in zip(rule_test['cis'], rule_results):
+            lines.append("\t\tTesting CI " + my_ci['resourceType'])
+            if result['error']:
+                lines.extend("\t\t\t" + line for line in result['error'].rstrip().splitlines())
+            elif result.get('evaluations') is not None:
+                lines.append("\t\t\t" + result['compliance'] + " (" + "{0:.1f}".format(result['duration'] * 1000) + " ms, " + str(len(result['evaluations'])) + " evaluations reported)")
+            else:
+                lines.append("\t\t\t" + result['compliance'])
+            if result.get('evaluations') and self.args.verbose:
+                lines.extend("\t\t\t\t" + json.dumps(evaluation, sort_keys=True, default=str) for evaluation in result['evaluations'])
+            if result['output'] and (self.args.verbose or result['error']):
+                lines.append(result['output'].rstrip())
+
+        with self.__print_lock:
+            print('\n'.join(lines))
+            sys.stdout.flush()
+
+    def benchmark(self):
+        parser = argparse.ArgumentParser(prog='rdk benchmark')
+        parser.add_argument('rulename', metavar='<rulename>', nargs='*', help='Rule name(s) to benchmark.')
+        parser.add_argument('--all','-a', action='store_true', help="All rules in the working directory will be benchmarked.")
+        parser.add_argument('--iterations', '-n', type=int, default=benchmark_iterations, help="[optional] Number of timed passes over each rule's test CIs.  Defaults to " + str(benchmark_iterations) + ".")
+        parser.add_argument('--warmup', type=int, default=benchmark_warmup, help="[optional] Number of untimed passes over each rule's test CIs before timing starts.  Defaults to " + str(benchmark_warmup) + ".")
+        parser.add_argument('--test-ci-types', '-t', help="[optional] CI type(s) to benchmark with, instead of the rule's configured Resource Types.")
+        parser.add_argument('--invoke', action='store_true', help="[optional] Benchmark the rule's Lambda handler, as test-local --invoke runs it, instead of evaluate_compliance.")
+        parser.add_argument('--profile-dir', help="[optional] Directory to write a cProfile stats file for each rule to.")
+        parser.add_argument('--save-baseline', help="[optional] File to save the results to as JSON, for later runs to be compared against.")
+        parser.add_argument('--baseline', help="[optional] Baseline file from an earlier run to compare the results with.")
+        parser.add_argument('--threshold', type=float, default=benchmark_regression_threshold, help="[optional] Percentage slowdown from the baseline that counts as a regression.  Defaults to " + str(benchmark_regression_threshold) + ".")
+        parser.set_defaults(ci_stream=None)
+        self.args = parser.parse_args(self.args.command_args, self.args)
+
+        if self.args.iterations < 1 or self.args.warmup < 0:
+            print("There must be at least one iteration, and the warm-up can't be negative.")
+            return 1
+
+        #Results are only comparable with a baseline taken with the same settings.
+        my_settings = {'invoke': self.args.invoke, 'iterations': self.args.iterations, 'warmup': self.args.warmup, 'test_ci_types': self.args.test_ci_types}
+        my_baseline = {}
+        if self.args.baseline:
+            with open(self.args.baseline, 'r') as baseline_file:
+                baseline_data = json.load(baseline_file)
+            if 'settings' not in baseline_data:
+                print("The baseline " + self.args.baseline + " does not record the settings it was taken with.  Save a new baseline to compare against.")
+                return 1
+            changed_settings = [name for name in sorted(my_settings) if baseline_data['settings'].get(name) != my_settings[name]]
+            if changed_settings:
+                print("Can't compare with the baseline " + self.args.baseline + ", which was taken with different settings: " + ", ".join(name + " " + str(baseline_data['settings'].get(name)) + " (now " + str(my_settings[name]) + ")" for name in changed_settings))
+                return 1
+            if baseline_data.get('python') != sys.version.split()[0]:
+                print("Warning: the baseline was taken with Python " + str(baseline_data.get('python')) + ", and this is Python " + sys.version.split()[0] + ".")
+            my_baseline = baseline_data['rules']
+
+        if self.args.profile_dir and not os.path.exists(self.args.profile_dir):
+            os.makedirs(self.args.profile_dir)
+
+        #Each rule gets a fresh worker process, and rules are benchmarked one at a time so they don't compete for the CPU.
+        my_results = {}
+        regressions = []
+        pool = get_worker_context().Pool(1, maxtasksperchild=1)
+        try:
+            for rule_name in self.__get_rule_list_for_command():
+                rule_test = self.__get_rule_test(rule_name)
+                if not rule_test:
+                    continue
+
+                print("Benchmarking " + rule_name + ": " + str(self.args.warmup) + " warm-up and " + str(self.args.iterations) + " timed passes over " + str(len(rule_test['cis'])) + " CIs")
+                profile_path = None
+                if self.args.profile_dir:
+                    profile_path = os.path.join(self.args.profile_dir, rule_name + '.pstats')
+                my_result = pool.apply(benchmark_rule, (rule_test, self.args.iterations, self.args.warmup, profile_path))
+                if 'error' in my_result:
+                    print(my_result['error'].rstrip())
+                    regressions.append(rule_name)
+                    continue
+
+                my_results[rule_name] = my_result
+                print(self.__format_benchmark(my_result))
+                if profile_path:
+                    print("\tProfile written to " + profile_path)
+
+                if rule_name in my_baseline and my_baseline[rule_name].get('ci_digest') != my_result['ci_digest']:
+                    print("\tNot compared with the baseline, which was taken with different test CIs.")
+                elif rule_name in my_baseline:
+                    comparison, regressed = self.__compare_benchmark(my_result, my_baseline[rule_name])
+                    print(comparison)
+                    if regressed:
+                        regressions.append(rule_name)
+        finally:
+            pool.close()
+            pool.join()
+
+        if self.args.save_baseline:
+            with open(self.args.save_baseline, 'w') as baseline_file:
+                json.dump({'created': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), 'python': sys.version.split()[0], 'settings': my_settings, 'rules': my_results}, baseline_file, indent=2, sort_keys=True)
+            print("Baseline saved to " + self.args.save_baseline)
+
+        if regressions:
+            print("Benchmark failed or regressed for: " + ", ".join(regressions))
+            return 1
+
+        return 0
+
+    def __format_benchmark(self, my_result):
+        memory = "n/a"
+        if my_result['peak_memory_bytes'] is not None:
+            memory = "{0:.1f} KiB".format(my_result['peak_memory_bytes'] / 1024.0)
+
+        return "\t" + str(my_result['calls']) + " calls: p50 " + "{0:.4f}".format(my_result['p50_ms']) + " ms, p95 " + "{0:.4f}".format(my_result['p95_ms']) + " ms, p99 " + "{0:.4f}".format(my_result['p99_ms']) + " ms, mean " + "{0:.4f}".format(my_result['mean_ms']) + " ms, largest peak allocation of a call " + memory
+
+    def __compare_benchmark(self, my_result, my_baseline):
+        #Returns a description of the change from the baseline, and whether it is a regression.
+        changes = []
+        regressed = False
+        for key in ['p50_ms', 'p95_ms', 'p99_ms', 'peak_memory_bytes']:
+            if not my_baseline.get(key) or my_result.get(key) is None:
+                continue
+            change = (my_result[key] - my_baseline[key]) * 100.0 / my_baseline[key]
+            flag = ""
+            if change > self.args.threshold:
+                flag = " REGRESSION"
+                regressed = True
+            changes.append(key.split('_')[0] + " " + "{0:+.1f}%".format(change) + flag)
+
+        return "\tCompared with baseline: " + ", ".join(changes), regressed
+
     def test_remote(self):
         print ("Running test_remote!")
         self.__parse_test_args()
@@ -458,8 +1388,7 @@ class rdk():
         rule_names = self.__get_rule_list_for_command()
 
         #Create our Lambda client.
-        my_session = self.__get_boto_session()
-        my_lambda_client = my_session.client('lambda')
+        my_lambda_client = self.__get_client('lambda')
 
         for rule_name in rule_names:
             print("Testing "+rule_name)
@@ -475,12 +1404,7 @@ class rdk():
                 print ("\t\tTesting CI " + my_ci['resourceType'])
 
                 #Generate test event from templates
-                test_event = json.load(open(os.path.join(os.getcwd(), rdk_dir, event_template_filename), 'r'), strict=False)
-                my_invoking_event = json.loads(test_event['invokingEvent'])
-                my_invoking_event['configurationItem'] = my_ci
-                my_invoking_event['notificationCreationTime'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.000Z')
-                test_event['invokingEvent'] = json.dumps(my_invoking_event)
-                test_event['ruleParameters'] = json.dumps(my_parameters)
+                test_event = build_test_event(self.__read_test_event_template(), my_ci, json.dumps(my_parameters))
 
                 #Get the Lambda function associated with the Rule
                 my_lambda_arn = self.__get_lambda_arn_for_rule(rule_name)
@@ -517,69 +1441,298 @@ class rdk():
     def logs(self):
         parser = argparse.ArgumentParser(
             prog='rdk '+self.args.command,
-            usage="rdk "+self.args.command + " <rulename> [-n/--number NUMBER] [-f/--follow]")
-        parser.add_argument('rulename', metavar='<rulename>', help='Rule whose logs will be displayed')
+            usage="rdk "+self.args.command + " <rulename> [<rulename> ...]|--all [-n/--number NUMBER] [-f/--follow] [--start TIME] [--end TIME] [--filter-pattern PATTERN] [-o/--output text|raw|json] [--sweeps]")
+        parser.add_argument('rulename', metavar='<rulename>', nargs='*', help='Rule(s) whose logs will be displayed')
+        parser.add_argument('--all','-a', action='store_true', help="Display the logs of all rules in the working directory.")
         parser.add_argument('-f','--follow',  action='store_true', help='Continuously poll Lambda logs and write to stdout.')
-        parser.add_argument('-n','--number',  default=3, help='Number of previous logged events to display.')
+        parser.add_argument('-n','--number', type=int, help='Number of previous logged events to display.  Defaults to 3, or to every event in the time range if --start or --end is given.')
+        parser.add_argument('--start', type=parse_log_time, help="[optional] Only display events from this time on.  Either a local time like 2017-11-15T22:00:00 or 2017-11-15, or a time relative to now like 30m, 2h or 1d.")
+        parser.add_argument('--end', type=parse_log_time, help="[optional] Only display events before this time, in the same format as --start.")
+        parser.add_argument('--filter-pattern', help="[optional] CloudWatch Logs filter pattern that events have to match.")
+        parser.add_argument('--output', '-o', choices=LogRenderer.formats, default='text', help="[optional] How to write log events: text for reading in a terminal, raw for just the messages, or json for one JSON event per line.  Defaults to text.")
+        parser.add_argument('--sweeps', action='store_true', help="[optional] Show the progress and duration of each shard of the rules' recent periodic sweeps, instead of log events.  --number sets how many sweeps to show.")
+        parser.add_argument('--sync', action='store_true', help="[optional] Copy the rules' new log events into the local log archive in " + rdk_dir + ", instead of displaying them.  --start sets where to start for rules that have not been synced before.")
+        parser.add_argument('--metrics', action='store_true', help="[optional] Summarize the rules' invocation latency and memory use as percentiles, from the Lambda REPORT lines and rule_util's phase timings, instead of displaying events.  Covers the last day unless --start or --end is given, and can be combined with --local.")
+        parser.add_argument('--local', action='store_true', help="[optional] Display events from the local log archive instead of CloudWatch Logs.  --filter-pattern is then plain text that events have to contain, with each word matched separately.")
         self.args = parser.parse_args(self.args.command_args, self.args)
 
-        self.args.rulename = self.__clean_rule_name(self.args.rulename)
+        if self.args.all and self.args.rulename:
+            print("You may specify either specific rules or --all, but not both.")
+            return 1
 
-        my_session = self.__get_boto_session()
-        cw_logs = my_session.client('logs')
-        log_group_name = self.__get_log_group_name()
+        if self.args.follow and (self.args.end or self.args.sync or self.args.local):
+            print("You may not use --end, --sync or --local with --follow.")
+            return 1
 
-        #Retrieve the last number of log events as specified by the user.
-        try:
-            log_streams = cw_logs.describe_log_streams(
-                logGroupName = log_group_name,
-                orderBy = 'LastEventTime',
-                descending = True,
-                limit = int(self.args.number) #This is the worst-case scenario if there is only one event per stream
-            )
+        if self.args.sync and (self.args.local or self.args.metrics):
+            print("You may not use --local or --metrics with --sync.")
+            return 1
+
+        if self.args.follow and self.args.metrics:
+            print("You may not use --metrics with --follow.")
+            return 1
+
+        rule_names = self.__get_rule_list_for_command()
+        if not rule_names:
+            print("Specify the rule(s) whose logs to display, or --all.")
+            return 1
 
-            #Sadly we can't just use filter_log_events, since we don't know the timestamps yet and filter_log_events doesn't appear to support ordering.
-            my_events = self.__get_log_events(cw_logs, log_streams, int(self.args.number))
+        cw_logs = self.__get_client('logs')
 
-            latest_timestamp = 0
+        if self.args.sweeps:
+            for rule_name in rule_names:
+                if len(rule_names) > 1:
+                    print(rule_name + ":")
+                try:
+                    self.__print_sweeps(cw_logs, self.__get_log_group_name(rule_name), self.args.number or 3)
+                except cw_logs.exceptions.ResourceNotFoundException as e:
+                    print(e.response['Error']['Message'])
+            return 0
+
+        if self.args.metrics:
+            return self.__print_log_metrics(cw_logs, rule_names)
+
+        if self.args.local:
+            archive = LogArchive(os.path.join(os.getcwd(), rdk_dir, log_archive_filename))
+            number_of_events = self.args.number
+            if not number_of_events and not (self.args.start or self.args.end or self.args.filter_pattern):
+                number_of_events = 3
+            my_events = archive.query(rule_names, self.args.start, self.args.end, self.args.filter_pattern, number_of_events)
+            archive.close()
+            if not my_events:
+                self.__print_status("No Events to display.")
+            LogRenderer(self.args.output).write(my_events)
+            return 0
+
+        if self.args.sync:
+            return self.__sync_logs(cw_logs, rule_names)
+
+        #Events are tagged with their rule when several rules' logs are shown together.
+        log_groups = [(self.__get_log_group_name(rule_name), rule_name if len(rule_names) > 1 else None) for rule_name in rule_names]
+        pool = ThreadPool(log_fetch_concurrency)
+        try:
+            if self.args.start or self.args.end or self.args.filter_pattern:
+                group_events = pool.map(lambda log_group: self.__filter_log_events(cw_logs, log_group), log_groups)
+                my_events = merge_log_events(group_events)
+                if self.args.number:
+                    my_events = my_events[-self.args.number:]
+            else:
+                my_events, group_events = self.__get_latest_log_events(cw_logs, log_groups, pool, self.args.number or 3)
 
-            if (my_events is None):
-                print("No Events to display.")
-                return(0)
+            renderer = LogRenderer(self.args.output)
 
-            for event in my_events:
-                if event['timestamp'] > latest_timestamp:
-                    latest_timestamp = event['timestamp']
+            if not my_events and not self.args.follow:
+                self.__print_status("No Events to display.")
+                return(0)
 
-                self.__print_log_event(event)
+            renderer.write(my_events)
 
             if self.args.follow:
+                tailers = [LogTailer(cw_logs, log_group_name, events, rule_name, self.args.filter_pattern, self.args.start) for (log_group_name, rule_name), events in zip(log_groups, group_events)]
+                #Each log group is polled on its own schedule, so idle groups keep backing off while busy ones are polled often.
+                next_polls = [time.time() + tailer.interval for tailer in tailers]
                 try:
                     while True:
-                        #Wait 2 seconds
-                        time.sleep(2)
+                        time.sleep(max(min(next_polls) - time.time(), 0))
+                        now = time.time()
+                        due = [index for index, next_poll in enumerate(next_polls) if next_poll <= now]
+                        renderer.write(merge_log_events(pool.map(lambda index: tailers[index].poll(), due)))
+                        for index in due:
+                            next_polls[index] = time.time() + tailers[index].interval
+                except KeyboardInterrupt as k:
+                    sys.exit(0)
+        finally:
+            pool.close()
+            pool.join()
 
-                        #Get all events between now and the timestamp of the most recent event.
-                        my_new_events = cw_logs.filter_log_events(
-                            logGroupName = log_group_name,
-                            startTime = latest_timestamp+1,
-                            endTime = int(time.time())*1000,
-                            interleaved = True)
+        return 0
 
+    def __print_log_metrics(self, cw_logs, rule_names):
+        if not self.args.start and not self.args.end:
+            self.args.start = int((time.time() - log_metrics_default_period) * 1000)
 
-                        for event in my_new_events['events']:
-                            if 'timestamp' in event:
-                                #Get the timestamp on the most recent event.
-                                if event['timestamp'] > latest_timestamp:
-                                    latest_timestamp = event['timestamp']
+        log_groups = [(self.__get_log_group_name(rule_name), rule_name) for rule_name in rule_names]
+        if self.args.local:
+            archive = LogArchive(os.path.join(os.getcwd(), rdk_dir, log_archive_filename))
+            my_events = archive.query(rule_names, self.args.start, self.args.end)
+            archive.close()
+        else:
+            #Only the REPORT lines and the embedded metric format lines are needed.
+            self.args.filter_pattern = log_metrics_filter_pattern
+            pool = ThreadPool(log_fetch_concurrency)
+            try:
+                group_events = pool.map(lambda log_group: self.__filter_log_events(cw_logs, log_group), log_groups)
+            finally:
+                pool.close()
+                pool.join()
+            my_events = [event for events in group_events for event in events]
+
+        rule_for_group = dict(log_groups)
+        rule_values = dict((rule_name, {}) for rule_name in rule_names)
+        for event in my_events:
+            my_values = rule_values[rule_for_group[event['logGroupName']]]
+            for name, value in parse_log_metrics(event['message']):
+                my_values.setdefault(name, []).append(value)
+
+        summary = collections.OrderedDict()
+        for rule_name in rule_names:
+            #Lambda's own figures come first, then rule_util's phases.
+            names = [name for name in log_report_metrics if name in rule_values[rule_name]]
+            names += sorted(name for name in rule_values[rule_name] if name not in log_report_metrics)
+            summary[rule_name] = collections.OrderedDict()
+            for name in names:
+                values = sorted(rule_values[rule_name][name])
+                summary[rule_name][name] = collections.OrderedDict([
+                    ('count', len(values)),
+                    ('p50', percentile(values, 50)),
+                    ('p95', percentile(values, 95)),
+                    ('p99', percentile(values, 99)),
+                    ('max', values[-1])
+                ])
+
+        if self.args.output == 'json':
+            print(json.dumps(summary, indent=2))
+            return 0
+
+        for rule_name, metrics in summary.items():
+            invocations = metrics.get('Duration (ms)', {}).get('count', 0)
+            print(rule_name + ": " + str(invocations) + " invocations")
+            if not metrics:
+                print("\tNo metrics were logged in this time range.")
+            for name, stats in metrics.items():
+                print("\t" + name + ": " + str(stats['count']) + " values, p50 " + "{0:.2f}".format(stats['p50']) + ", p95 " + "{0:.2f}".format(stats['p95']) + ", p99 " + "{0:.2f}".format(stats['p99']) + ", max " + "{0:.2f}".format(stats['max']))
 
-                                #Print the event.
-                                self.__print_log_event(event)
-                except KeyboardInterrupt as k:
-                    sys.exit(0)
+        return 0
+
+    def __sync_logs(self, cw_logs, rule_names):
+        #Log groups are read concurrently, and their pages are written to the archive from this thread as they arrive.
+        start_time = time.time()
+        archive = LogArchive(os.path.join(os.getcwd(), rdk_dir, log_archive_filename))
+        pages = queue.Queue()
+
+        def fetch(sync_args):
+            rule_name, filter_args = sync_args
+            try:
+                while True:
+                    response = cw_logs.filter_log_events(**filter_args)
+                    pages.put((rule_name, response['events'], None))
+                    if not response.get('nextToken'):
+                        break
+                    filter_args['nextToken'] = response['nextToken']
+            except cw_logs.exceptions.ResourceNotFoundException as e:
+                pages.put((rule_name, None, e.response['Error']['Message']))
+                return
+            except Exception as e:
+                pages.put((rule_name, None, "Could not sync " + rule_name + ": " + str(e)))
+                return
+            pages.put((rule_name, None, None))
+
+        sync_args = []
+        checkpoints = {}
+        for rule_name in rule_names:
+            filter_args = {'logGroupName': self.__get_log_group_name(rule_name)}
+            checkpoints[rule_name] = archive.get_checkpoint(filter_args['logGroupName'])
+            if checkpoints[rule_name] is not None:
+                #Events can reach CloudWatch Logs after later ones, so each sync goes back a little; events already in the archive are skipped.
+                filter_args['startTime'] = max(checkpoints[rule_name] - log_sync_overlap, 0)
+            elif self.args.start:
+                filter_args['startTime'] = self.args.start
+            sync_args.append((rule_name, filter_args))
+
+        pool = ThreadPool(log_fetch_concurrency)
+        try:
+            pool.map_async(fetch, sync_args)
+            new_events = dict((rule_name, 0) for rule_name in rule_names)
+            errors = 0
+            remaining = len(rule_names)
+            while remaining:
+                rule_name, events, error = pages.get()
+                if events is not None:
+                    new_events[rule_name] += archive.store(self.__get_log_group_name(rule_name), rule_name, events)
+                    if events:
+                        checkpoints[rule_name] = max([checkpoints[rule_name] or 0] + [event['timestamp'] for event in events])
+                    continue
+
+                remaining -= 1
+                if error:
+                    errors += 1
+                    print(error)
+                    continue
+
+                #The checkpoint only moves once every page of the log group has been stored.
+                if checkpoints[rule_name] is not None:
+                    archive.set_checkpoint(self.__get_log_group_name(rule_name), rule_name, checkpoints[rule_name])
+                print("Synced " + rule_name + ": " + str(new_events[rule_name]) + " new events.")
+        finally:
+            pool.close()
+            pool.join()
+
+        print("Log archive has " + str(archive.count()) + " events.  Synced " + str(len(rule_names) - errors) + " of " + str(len(rule_names)) + " rules in " + "{:.1f}".format(time.time() - start_time) + " seconds.")
+        archive.close()
+        if errors:
+            return 1
+        return 0
 
+    def __get_latest_log_events(self, cw_logs, log_groups, pool, number_of_events):
+        #The most recent events are in the most recently written streams.  With one event per stream in the worst case, reading
+        #the latest events of that many streams of every group is always enough; the streams are read concurrently and merged.
+        def describe_streams(log_group):
+            try:
+                return cw_logs.describe_log_streams(
+                    logGroupName = log_group[0],
+                    orderBy = 'LastEventTime',
+                    descending = True,
+                    limit = number_of_events
+                )['logStreams']
+            except cw_logs.exceptions.ResourceNotFoundException as e:
+                self.__print_status(e.response['Error']['Message'])
+                return []
+
+        streams = []
+        for group_index, log_streams in enumerate(pool.map(describe_streams, log_groups)):
+            streams.extend((group_index, log_stream['logStreamName']) for log_stream in log_streams)
+
+        def get_stream_events(stream):
+            log_group_name, rule_name = log_groups[stream[0]]
+            events = cw_logs.get_log_events(
+                logGroupName = log_group_name,
+                logStreamName = stream[1],
+                limit = number_of_events
+            )['events']
+            return [tag_log_event(event, log_group_name, stream[1], rule_name) for event in events]
+
+        stream_events = pool.map(get_stream_events, streams)
+        group_events = [[] for log_group in log_groups]
+        for stream, events in zip(streams, stream_events):
+            group_events[stream[0]].append(events)
+        group_events = [merge_log_events(event_lists) for event_lists in group_events]
+
+        return merge_log_events(group_events)[-number_of_events:], group_events
+
+    def __filter_log_events(self, cw_logs, log_group):
+        #Reads every page of a log group's events in the time range that match the filter pattern, in time order.
+        log_group_name, rule_name = log_group
+        filter_args = {'logGroupName': log_group_name}
+        if self.args.start:
+            filter_args['startTime'] = self.args.start
+        if self.args.end:
+            filter_args['endTime'] = self.args.end
+        if self.args.filter_pattern:
+            filter_args['filterPattern'] = self.args.filter_pattern
+
+        events = []
+        try:
+            while True:
+                response = cw_logs.filter_log_events(**filter_args)
+                events.extend(tag_log_event(event, log_group_name, event.get('logStreamName'), rule_name) for event in response['events'])
+                if not response.get('nextToken'):
+                    break
+                filter_args['nextToken'] = response['nextToken']
         except cw_logs.exceptions.ResourceNotFoundException as e:
-            print(e.response['Error']['Message'])
+            self.__print_status(e.response['Error']['Message'])
+
+        events.sort(key=lambda event: event['timestamp'])
+        return events
 
     def __clean_rule_name(self, rule_name):
         output = rule_name
@@ -613,50 +1766,146 @@ class rdk():
             else :
                 shutil.copytree(src, dst)
 
-    def __print_log_event(self, event):
-        time_string = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['timestamp']/1000))
+    def __print_rule(self, rule_name, message):
+        #When several rules are being processed at once, prefix each line with the rule name so the output stays readable.
+        if self.__prefix_output:
+            message = '\n'.join("[" + rule_name + "] " + line for line in str(message).splitlines())
+
+        with self.__print_lock:
+            print(message)
+            sys.stdout.flush()
+
+    def __print_sweeps(self, cw_logs, log_group_name, number_of_sweeps):
+        #rule_util logs a JSON line for each shard of a sweep.  Group them by sweep to show how far each sweep got.
+        sweeps = {}
+        filter_args = {
+            'logGroupName': log_group_name,
+            'filterPattern': '"rdkSweep"',
+            'startTime': int((time.time() - sweep_log_days * 24 * 60 * 60) * 1000)
+        }
+        while True:
+            response = cw_logs.filter_log_events(**filter_args)
+            for event in response['events']:
+                message = event['message']
+                try:
+                    shard = json.loads(message[message.index('{'):])['rdkSweep']
+                except (ValueError, KeyError, TypeError):
+                    continue
+                sweeps.setdefault(shard['sweepId'], {})[shard['shard']] = shard
+            if not response.get('nextToken'):
+                break
+            filter_args['nextToken'] = response['nextToken']
+
+        if not sweeps:
+            print("No sweeps were logged in the last " + str(sweep_log_days) + " days.")
+            return 0
+
+        sweep_ids = sorted(sweeps, key=lambda sweep_id: min(shard['sweepStartedAt'] for shard in sweeps[sweep_id].values()))
+        for sweep_id in sweep_ids[-number_of_sweeps:]:
+            shards = [sweeps[sweep_id][shard_number] for shard_number in sorted(sweeps[sweep_id])]
+            last_shard = shards[-1]
+            status = last_shard['status']
+            if status == 'continued':
+                status = 'in progress'
+            if len(shards) != last_shard['shard'] + 1:
+                status += ", " + str(last_shard['shard'] + 1 - len(shards)) + " shards missing from the logs"
+            totals = dict((key, sum(shard[key] for shard in shards)) for key in ['resources', 'evaluations', 'errors', 'dropped'])
+            duration = last_shard['startedAt'] + last_shard['seconds'] - last_shard['sweepStartedAt']
+
+            print("Sweep " + sweep_id + ": " + status + ", " + str(len(shards)) + " shards in " + "{:.1f}".format(duration) + " seconds.  " + self.__format_sweep_counts(totals))
+            for shard in shards:
+                print("\tShard " + str(shard['shard']) + ": " + shard['status'] + " in " + "{:.1f}".format(shard['seconds']) + " seconds.  " + self.__format_sweep_counts(shard))
 
-        rows, columns = os.popen('stty size', 'r').read().split()
-        line_wrap = int(columns) - 22
-        message_lines = str(event['message']).splitlines()
-        formatted_lines = []
+        return 0
 
-        for line in message_lines:
-            line = line.replace('\t','    ')
-            formatted_lines.append('\n'.join(line[i:i+line_wrap] for i in range(0, len(line), line_wrap)))
+    def __format_sweep_counts(self, counts):
+        return str(counts['resources']) + " resources, " + str(counts['evaluations']) + " evaluations, " + str(counts['errors']) + " errors, " + str(counts['dropped']) + " dropped"
 
-        message_string = '\n'.join(formatted_lines)
-        message_string = message_string.replace('\n','\n                      ')
+    def __get_log_group_name(self, rule_name):
+        return '/aws/lambda/RDK-Rule-Function-' + rule_name
 
-        print(time_string + " - " + message_string)
+    def __get_boto_session(self):
+        #One session is shared by the whole run.  Sessions are not thread-safe, so clients are created through __get_client.
+        with self.__session_lock:
+            if not self.__session:
+                self.__session = self.__create_boto_session()
 
-    def __get_log_events(self, my_client, log_streams, number_of_events):
-        event_count = 0
-        log_events = []
-        for stream in log_streams['logStreams']:
-            #Retrieve the logs for this stream.
-            events = my_client.get_log_events(
-                logGroupName = self.__get_log_group_name(),
-                logStreamName = stream['logStreamName'],
-                limit = int(number_of_events)
-            )
+        return self.__session
+
+    def __get_client(self, service):
+        #Clients are thread-safe once created, so each service client is built once and shared by every rule.
+        my_session = self.__get_boto_session()
+        with self.__session_lock:
+            if service not in self.__clients:
+                self.__clients[service] = my_session.client(service)
 
-            #Go through the logs and add events to my output array.
-            for event in events['events']:
-                log_events.append(event)
-                event_count = event_count + 1
+            return self.__clients[service]
 
-                #Once we have enough events, stop.
-                if event_count >= number_of_events:
-                    return log_events
+    def __get_account_id(self):
+        with self.__session_lock:
+            if self.__account_id:
+                return self.__account_id
 
-        #If more records were requested than exist, return as many as we found.
-        return log_events
+        #Credentials don't change during a run, so the caller identity only needs to be looked up once.
+        identity_key = self.__get_identity_key()
+        account_id = self.__read_cache_entry('account_id', identity_key)
+        if not account_id:
+            response = self.__get_client('sts').get_caller_identity()
+            account_id = response['Account']
+            self.__write_cache_entry('account_id', identity_key, account_id)
 
-    def __get_log_group_name(self):
-        return '/aws/lambda/RDK-Rule-Function-' + self.args.rulename
+        with self.__session_lock:
+            self.__account_id = account_id
 
-    def __get_boto_session(self):
+        return account_id
+
+    def __get_identity_key(self):
+        #Cache entries belong to the credentials the session resolved to, wherever they came from, and the region.
+        my_session = self.__get_boto_session()
+        my_credentials = my_session.get_credentials()
+        if not my_credentials or not my_credentials.access_key:
+            return None
+
+        return hashlib.sha256(my_credentials.access_key.encode('utf-8')).hexdigest()[:16] + ":" + str(my_session.region_name)
+
+    def __read_cache_entry(self, section, key):
+        #The on-disk cache is only used when a TTL has been given with --cache-ttl, and the credentials are known.
+        if not self.args.cache_ttl or not key:
+            return None
+
+        with self.__cache_lock:
+            my_cache = self.__read_cache_file()
+
+        my_entry = my_cache.get(section, {}).get(key)
+        if not my_entry or my_entry['expires'] < time.time():
+            return None
+
+        return my_entry['value']
+
+    def __write_cache_entry(self, section, key, value):
+        if not self.args.cache_ttl or not key:
+            return
+
+        with self.__cache_lock:
+            my_cache = self.__read_cache_file()
+            my_cache.setdefault(section, {})[key] = {'value': value, 'expires': time.time() + self.args.cache_ttl}
+            cache_path = os.path.join(os.getcwd(), rdk_dir, cache_filename)
+            with open(cache_path, 'w') as cache_file:
+                json.dump(my_cache, cache_file, indent=2, sort_keys=True)
+
+    def __read_cache_file(self):
+        cache_path = os.path.join(os.getcwd(), rdk_dir, cache_filename)
+        if not os.path.exists(cache_path):
+            return {}
+
+        try:
+            with open(cache_path, 'r') as cache_file:
+                return json.load(cache_file)
+        except ValueError:
+            #A corrupt cache is no worse than an empty one.
+            return {}
+
+    def __create_boto_session(self):
         session_args = {}
 
         if self.args.region:
@@ -686,7 +1935,10 @@ class rdk():
                             if os.path.exists(os.path.join(obj_path, 'RuleCode.cs')):
                                 rule_names.append(obj_name)
         else:
-            rule_names.append(self.__clean_rule_name(self.args.rulename[0]))
+            for rule_arg in self.args.rulename:
+                for rule_name in rule_arg.split(','):
+                    if rule_name and self.__clean_rule_name(rule_name) not in rule_names:
+                        rule_names.append(self.__clean_rule_name(rule_name))
 
         return rule_names
 
@@ -712,6 +1964,8 @@ class rdk():
         parser.add_argument('-r','--resource-types', required=is_required, help='Resource types that trigger event-based rule evaluation')
         parser.add_argument('-m','--maximum-frequency', help='Maximum execution frequency', choices=['One_Hour','Three_Hours','Six_Hours','Twelve_Hours','TwentyFour_Hours'])
         parser.add_argument('-i','--input-parameters', help="[optional] JSON for Config parameters for testing.")
+        parser.add_argument('--periodic-sweep', dest='periodic_sweep', action='store_true', default=None, help="[optional] Also evaluate every resource of the rule's Resource Types at the maximum execution frequency.  Only supported for the python runtimes.")
+        parser.add_argument('--no-periodic-sweep', dest='periodic_sweep', action='store_false', help="[optional] Turn off periodic sweeps for the rule.")
         self.args = parser.parse_args(self.args.command_args, self.args)
 
     def __parse_test_args(self):
@@ -721,6 +1975,12 @@ class rdk():
         parser.add_argument('--test-ci-json', '-j', help="[optional] JSON for test CI for testing.")
         parser.add_argument('--test-ci-types', '-t', help="[optional] CI type to use for testing.")
         parser.add_argument('--verbose', '-v', action='store_true', help='Enable full log output')
+        parser.add_argument('--processes', type=int, help="[optional] Number of worker processes to test rules in.  Defaults to the number of CPUs.")
+        parser.add_argument('--timeout', type=int, default=test_ci_timeout, help="[optional] Number of seconds a rule may spend on one test CI before it is stopped.  Defaults to " + str(test_ci_timeout) + ".")
+        parser.add_argument('--invoke', action='store_true', help="[optional] Call each rule's Lambda handler with a Config event, as Lambda would, instead of calling evaluate_compliance directly.  Evaluations are recorded locally instead of being sent to Config.")
+        parser.add_argument('--ci-stream', help="[optional] File of newline-delimited CI JSON to evaluate the rules against, optionally gzipped, or - to read from stdin.")
+        parser.add_argument('--batch-size', type=int, default=stream_batch_size, help="[optional] Number of streamed CIs to send to a worker at a time.  Defaults to " + str(stream_batch_size) + ".")
+        parser.add_argument('--results-file', help="[optional] File to write --ci-stream results to as JSON lines.  Defaults to stdout.")
         self.args = parser.parse_args(self.args.command_args, self.args)
 
         if self.args.all and self.args.rulename:
@@ -728,14 +1988,6 @@ class rdk():
             return 1
 
     def __write_params_file(self):
-        #create custom session based on whatever credentials are available to us
-        my_session = self.__get_boto_session()
-
-        #get accountID
-        my_sts = my_session.client('sts')
-        response = my_sts.get_caller_identity()
-        account_id = response['Account']
-
         my_input_params = {}
 
         if self.args.input_parameters:
@@ -761,6 +2013,9 @@ class rdk():
         if self.args.maximum_frequency:
             parameters['SourcePeriodic'] = self.args.maximum_frequency
 
+        if self.args.periodic_sweep:
+            parameters['PeriodicSweep'] = 'true'
+
         my_params = {"Parameters": parameters}
         params_file_path = os.path.join(os.getcwd(), rules_dir, self.args.rulename, parameter_file_name)
         parameters_file = open(params_file_path, 'w')
@@ -775,16 +2030,17 @@ class rdk():
         parameters_file.close()
         return my_params
 
-    def __wait_for_cfn_stack(self, cfn_client, stackname):
-        in_progress = True
-        while in_progress:
-            my_stack = cfn_client.describe_stacks(StackName=stackname)
+    def __wait_for_cfn_stack(self, stackname):
+        #All waits in this run share one tracker, so concurrent deploys are polled together.
+        with self.__stack_tracker_lock:
+            if not self.__stack_tracker:
+                my_cfn = self.__get_client('cloudformation')
+                self.__stack_tracker = CfnStackTracker(my_cfn, self.__print_rule)
 
-            if 'IN_PROGRESS' not in my_stack['Stacks'][0]['StackStatus']:
-                in_progress = False
-            else:
-                print("Waiting for CloudFormation stack operation to complete...")
-                time.sleep(5)
+        return self.__stack_tracker.wait(stackname)
+
+    def __is_failed_stack(self, my_stack):
+        return 'ROLLBACK' in my_stack['StackStatus'] or my_stack['StackStatus'].endswith('FAILED')
 
     def __get_handler(self, rule_name, params):
         if params['SourceRuntime'] in ['python2.7','python3.6','nodejs4.3','nodejs6.10']:
@@ -796,6 +2052,17 @@ class rdk():
 
     def __get_test_CIs(self, rulename):
         test_ci_list = []
+        #Check to see if there are test CI fixtures in the Rule directory
+        my_fixtures = self.__get_test_ci_fixtures(rulename)
+        if my_fixtures is not None and self.args.test_ci_types:
+            my_fixtures = my_fixtures.filter(self.args.test_ci_types.split(","))
+            if len(my_fixtures):
+                print("\tTesting with " + str(len(my_fixtures)) + " CI's of the supplied Resource Type(s) from the test fixtures")
+                return my_fixtures
+        elif my_fixtures is not None:
+            print("\tTesting with " + str(len(my_fixtures)) + " CI's provided in the test fixtures")
+            return my_fixtures
+
         if self.args.test_ci_types:
             print("\tTesting with generic CI for supplied Resource Type(s)")
             ci_types = self.args.test_ci_types.split(",")
@@ -803,42 +2070,84 @@ class rdk():
                 my_test_ci = TestCI(ci_type)
                 test_ci_list.append(my_test_ci.get_json())
         else:
-            #Check to see if there is a test_ci.json file in the Rule directory
-            tests_path = os.path.join(os.getcwd(), rules_dir, rulename, test_ci_filename)
-            if os.path.exists(tests_path):
-                print("\tTesting with CI's provided in test_ci.json file. NOT YET IMPLEMENTED") #TODO
-            #    test_ci_list self._load_cis_from_file(tests_path)
-            else:
-                print("\tTesting with generic CI for configured Resource Type(s)")
-                my_rule_params = self.__get_rule_parameters(rulename)
-                ci_types = str(my_rule_params['SourceEvents']).split(",")
-                for ci_type in ci_types:
-                    my_test_ci = TestCI(ci_type)
-                    test_ci_list.append(my_test_ci.get_json())
+            print("\tTesting with generic CI for configured Resource Type(s)")
+            my_rule_params = self.__get_rule_parameters(rulename)
+            ci_types = str(my_rule_params['SourceEvents']).split(",")
+            for ci_type in ci_types:
+                my_test_ci = TestCI(ci_type)
+                test_ci_list.append(my_test_ci.get_json())
 
         return test_ci_list
 
-    def __get_lambda_arn_for_rule(self, rulename):
-        #create custom session based on whatever credentials are available to us
-        my_session = self.__get_boto_session()
-
-        my_cfn = my_session.client('cloudformation')
-
-        #Since CFN won't detect changes to the lambda code stored in S3 as a reason to update the stack, we need to manually update the code reference in Lambda once the CFN has run.
-        self.__wait_for_cfn_stack(my_cfn, rulename)
+    def __get_test_ci_fixtures(self, rulename):
+        #Fixtures live in the rule's test_ci.json file and/or the files in its test_ci directory.  Returns None if there are none.
+        rule_path = os.path.join(os.getcwd(), rules_dir, rulename)
+        fixture_paths = []
+        if os.path.isfile(os.path.join(rule_path, test_ci_filename)):
+            fixture_paths.append(os.path.join(rule_path, test_ci_filename))
+        for dir_path, dir_names, file_names in os.walk(os.path.join(rule_path, test_ci_dirname)):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if os.path.splitext(file_name)[1] in test_ci_extensions:
+                    fixture_paths.append(os.path.join(dir_path, file_name))
+
+        if not fixture_paths:
+            return None
+
+        #Indexing a fixture file means scanning all of it, so indexes are kept until the file changes.
+        index_path = os.path.join(os.getcwd(), rdk_dir, test_ci_index_filename)
+        my_indexes = {}
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as index_file:
+                my_indexes = json.load(index_file)
+
+        entries = []
+        indexes_changed = False
+        for fixture_path in fixture_paths:
+            fixture_stat = os.stat(fixture_path)
+            my_index = my_indexes.get(fixture_path)
+            if my_index is None or my_index['mtime'] != fixture_stat.st_mtime or my_index['size'] != fixture_stat.st_size:
+                my_index = {'mtime': fixture_stat.st_mtime, 'size': fixture_stat.st_size, 'entries': TestCIFixtures.index_file(fixture_path)}
+                my_indexes[fixture_path] = my_index
+                indexes_changed = True
+            for start, end, resource_type in my_index['entries']:
+                entries.append((fixture_path, start, end, resource_type))
+
+        if indexes_changed:
+            with open(index_path, 'w') as index_file:
+                json.dump(my_indexes, index_file)
+
+        return TestCIFixtures(entries)
+
+    def __get_lambda_arn_for_rule(self, rulename, my_stack=None):
+        cache_key = self.__get_identity_key()
+        if cache_key:
+            cache_key = cache_key + ":" + rulename
+        if not my_stack:
+            if rulename in self.__lambda_arns:
+                return self.__lambda_arns[rulename]
+
+            cached_arn = self.__read_cache_entry('lambda_arn', cache_key)
+            if cached_arn:
+                self.__lambda_arns[rulename] = cached_arn
+                return cached_arn
+
+            my_stack = self.__wait_for_cfn_stack(rulename)
 
         #Lamba function is an output of the stack.
-        my_updated_stack = my_cfn.describe_stacks(StackName=rulename)
-        cfn_outputs = my_updated_stack['Stacks'][0]['Outputs']
+        cfn_outputs = my_stack.get('Outputs', [])
         my_lambda_arn = 'NOTFOUND'
         for output in cfn_outputs:
             if output['OutputKey'] == 'RuleCodeLambda':
                 my_lambda_arn = output['OutputValue']
 
         if my_lambda_arn == 'NOTFOUND':
-            print("Could not read CloudFormation stack output to find Lambda function.")
+            self.__print_rule(rulename, "Could not read CloudFormation stack output to find Lambda function.")
             sys.exit(1)
 
+        self.__lambda_arns[rulename] = my_lambda_arn
+        self.__write_cache_entry('lambda_arn', cache_key, my_lambda_arn)
+
         return my_lambda_arn
 
 class TestCI():
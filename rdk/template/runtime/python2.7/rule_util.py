@@ -2,13 +2,126 @@
 # This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
 #
 
+import time
+IMPORT_STARTED = time.time()
+
+import os
 import json
-import boto3
 import datetime
+import random
+import traceback
+import collections
+import importlib
 
 # USE ENTIRE FILE AS IS
 
-aws_config = boto3.client('config')
+# Cold start budget in milliseconds: from this module being imported, through the first invocation, including AWS client creation.
+# The measured cold start is printed in test mode.
+COLD_START_BUDGET_MS = 1000
+
+# Imports a module the first time one of its attributes is used.
+class LazyModule(object):
+    def __init__(self, module_name):
+        self.module_name = module_name
+        self.module = None
+
+    def __getattr__(self, name):
+        # Only reached for attributes the object doesn't have itself, e.g. while it is being copied.
+        if name in ('module_name', 'module') or name.startswith('__'):
+            raise AttributeError(name)
+        if self.module is None:
+            self.module = importlib.import_module(self.module_name)
+        return getattr(self.module, name)
+
+# Rules get boto3 through `from rule_util import *`, so the name is still exported, but boto3 is only imported when it is first used.
+boto3 = LazyModule('boto3')
+
+# Creates an AWS client the first time it is used, and keeps it for as long as the container stays warm.
+# Invocations that never call the service don't pay for importing boto3 or building the client.
+class LazyClient(object):
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self.client = None
+        self.init_duration = 0
+
+    def get_client(self):
+        if self.client is None:
+            started = time.time()
+            self.client = boto3.client(self.service_name)
+            self.init_duration = time.time() - started
+        return self.client
+
+    def __getattr__(self, name):
+        # Only reached for attributes the object doesn't have itself, e.g. while it is being copied.
+        if name in ('service_name', 'client', 'init_duration') or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.get_client(), name)
+
+aws_config = LazyClient('config')
+aws_lambda = LazyClient('lambda')
+
+# Config accepts up to 100 evaluations per PutEvaluations call.  Throttled calls are retried with jittered exponential backoff,
+# for as long as the retry limit and the Lambda function's remaining time allow.
+MAX_EVALUATIONS_PER_CALL = 100
+MAX_RETRIES = 6
+RETRY_BASE_DELAY = 0.2
+RETRY_MAX_DELAY = 10
+RETRY_TIME_BUFFER = 2
+THROTTLING_ERROR_CODES = ['Throttling', 'ThrottlingException', 'TooManyRequestsException', 'RequestLimitExceeded']
+
+# Periodic sweeps evaluate every resource of the rule's resource types, which the rdk template passes in this environment variable.
+# Configurations are fetched 100 at a time, and a sweep hands over to a new invocation when the Lambda function has less than
+# SWEEP_TIME_BUFFER seconds left.
+RESOURCE_TYPES_VARIABLE = 'RDK_RESOURCE_TYPES'
+MAX_RESOURCE_KEYS_PER_CALL = 100
+SWEEP_TIME_BUFFER = 10
+# Configuration items fetched for oversized notifications are kept for later invocations of a warm container, since noisy resources
+# send many notifications for the same change.  Items expire after CONFIGURATION_CACHE_TTL seconds.
+CONFIGURATION_CACHE_SIZE = 256
+CONFIGURATION_CACHE_TTL = 300
+# Each invocation logs how long its phases took as a CloudWatch embedded metric format line, which CloudWatch turns into
+# metrics in METRICS_NAMESPACE and `rdk logs --metrics` summarizes.  Set EMIT_METRICS to False to leave the line out.
+EMIT_METRICS = True
+METRICS_NAMESPACE = 'RDK'
+first_invocation = None
+cold_start_reported = False
+
+# A bounded cache that evicts the least recently used item, and ignores items older than ttl seconds.
+class LRUCache(object):
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        item = self.items.pop(key, None)
+        if item is None or time.time() - item[0] > self.ttl:
+            self.misses += 1
+            return None
+        self.items[key] = item
+        self.hits += 1
+        return item[1]
+
+    def put(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = (time.time(), value)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+configuration_cache = LRUCache(CONFIGURATION_CACHE_SIZE, CONFIGURATION_CACHE_TTL)
+
+# Adds up the milliseconds an invocation spends in each phase, and notes the configuration cache counts it started with.
+class PhaseTimer(object):
+    def __init__(self):
+        self.started = time.time()
+        self.phases = collections.OrderedDict()
+        self.cacheHits = configuration_cache.hits
+        self.cacheMisses = configuration_cache.misses
+
+    def add(self, phase, started):
+        self.phases[phase] = self.phases.get(phase, 0) + (time.time() - started) * 1000
 
 # Helper function to check if rule parameters exist
 def parameters_exist(parameters):
@@ -31,14 +144,19 @@ def is_scheduled_notification(messageType):
     return messageType == 'ScheduledNotification'
 
 # Get configurationItem using getResourceConfigHistory API. in case of OversizedConfigurationItemChangeNotification
-def get_configuration(resourceType, resourceId, configurationCaptureTime):
-    result = aws_config.get_resource_config_history(
-        resourceType=resourceType,
-        resourceId=resourceId,
-        laterTime=configurationCaptureTime,
-        limit=1)
-    configurationItem = result['configurationItems'][0]
-    return convert_api_configuration(configurationItem)
+# The item is cached, and the same object is returned for later lookups of the same change, so it should not be modified.
+def get_configuration(resourceType, resourceId, configurationCaptureTime, context=None):
+    key = (resourceType, resourceId, configurationCaptureTime)
+    configurationItem = configuration_cache.get(key)
+    if configurationItem is None:
+        result = call_with_retry(aws_config.get_resource_config_history, context,
+            resourceType=resourceType,
+            resourceId=resourceId,
+            laterTime=configurationCaptureTime,
+            limit=1)[0]
+        configurationItem = convert_api_configuration(result['configurationItems'][0])
+        configuration_cache.put(key, configurationItem)
+    return configurationItem
 
 # Convert from the API model to the original invocation model
 def convert_api_configuration(configurationItem):
@@ -56,11 +174,11 @@ def convert_api_configuration(configurationItem):
     return configurationItem
 
 # Based on the type of message get the configuration item either from configurationItem in the invoking event or using the getResourceConfigHistiry API in getConfiguration function.
-def get_configuration_item(invokingEvent):
+def get_configuration_item(invokingEvent, context=None):
     check_defined(invokingEvent, 'invokingEvent')
     if is_oversized_changed_notification(invokingEvent['messageType']):
         configurationItemSummary = check_defined(invokingEvent['configurationItemSummary'], 'configurationItemSummary')
-        return get_configuration(configurationItemSummary['resourceType'], configurationItemSummary['resourceId'], configurationItemSummary['configurationItemCaptureTime'])
+        return get_configuration(configurationItemSummary['resourceType'], configurationItemSummary['resourceId'], configurationItemSummary['configurationItemCaptureTime'], context)
     elif is_scheduled_notification(invokingEvent['messageType']):
         return None
     else:
@@ -74,39 +192,341 @@ def is_applicable(configurationItem, event):
     eventLeftScope = event['eventLeftScope']
     return (status == 'OK' or status == 'ResourceDiscovered') and eventLeftScope == False
 
+# Seconds left before Lambda times out the invocation, or None if there is no context to ask.
+def get_remaining_seconds(context):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return context.get_remaining_time_in_millis() / 1000.0
+
+def is_throttling_error(e):
+    response = getattr(e, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    return response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+# Call an AWS API, retrying throttled calls with jittered exponential backoff.  Returns the response and the number of retries,
+# or raises the throttling error once the retries or the remaining time run out.
+def call_with_retry(api_call, context=None, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            return api_call(**kwargs), attempt
+        except Exception as e:
+            if not is_throttling_error(e):
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            remaining = get_remaining_seconds(context)
+            if attempt >= MAX_RETRIES or (remaining is not None and remaining < delay + RETRY_TIME_BUFFER):
+                e.retries = attempt
+                raise
+            attempt += 1
+            time.sleep(delay)
+
+# Turn what the rule returned into evaluations.  A rule can return a compliance type for the configuration item, an evaluation,
+# or a list of evaluations.  Evaluations default to the configuration item's resource and capture time.
+def build_evaluations(compliance, configurationItem):
+    if not isinstance(compliance, (list, dict)):
+        compliance = [{'ComplianceType': compliance}]
+    elif isinstance(compliance, dict):
+        compliance = [compliance]
+    evaluations = []
+    for evaluation in compliance:
+        evaluation = dict(evaluation)
+        evaluation.setdefault('ComplianceResourceType', configurationItem['resourceType'])
+        evaluation.setdefault('ComplianceResourceId', configurationItem['resourceId'])
+        evaluation.setdefault('OrderingTimestamp', configurationItem['configurationItemCaptureTime'])
+        evaluations.append(evaluation)
+    return evaluations
+
+# Report evaluations to Config in chunks of up to 100.  Evaluations that are still throttled after retrying, or that Config
+# rejects, are dropped.  The counts are added to metrics if it is given, and logged otherwise.  Returns the number of dropped evaluations.
+def report_evaluations(evaluations, resultToken, testMode=False, context=None, metrics=None):
+    calls = 0
+    retries = 0
+    dropped = 0
+    for start in range(0, len(evaluations), MAX_EVALUATIONS_PER_CALL):
+        chunk = evaluations[start:start + MAX_EVALUATIONS_PER_CALL]
+        try:
+            response, chunk_retries = call_with_retry(aws_config.put_evaluations, context, Evaluations=chunk, ResultToken=resultToken, TestMode=testMode)
+        except Exception as e:
+            if not is_throttling_error(e):
+                raise
+            print("Dropping {} evaluations, PutEvaluations is still throttled after {} retries.".format(len(chunk), e.retries))
+            calls += e.retries + 1
+            retries += e.retries
+            dropped += len(chunk)
+            continue
+        calls += chunk_retries + 1
+        retries += chunk_retries
+        failed = response.get('FailedEvaluations', [])
+        for evaluation in failed:
+            print("Config did not accept the evaluation: " + json.dumps(evaluation, default=str))
+        dropped += len(failed)
+    if metrics is None:
+        log_put_metrics({'evaluations': len(evaluations), 'calls': calls, 'retries': retries, 'dropped': dropped})
+    else:
+        metrics['evaluations'] += len(evaluations)
+        metrics['calls'] += calls
+        metrics['retries'] += retries
+        metrics['dropped'] += dropped
+    return dropped
+
+def log_put_metrics(metrics):
+    print("PutEvaluations: {} evaluations in {} calls, {} retries, {} dropped".format(metrics['evaluations'], metrics['calls'], metrics['retries'], metrics['dropped']))
+
+# Convert from the BatchGetResourceConfig model to the original invocation model
+def convert_base_configuration(configurationItem):
+    for k, v in configurationItem.items():
+        if isinstance(v, datetime.datetime):
+            configurationItem[k] = str(v)
+    configurationItem['awsAccountId'] = configurationItem['accountId']
+    configurationItem['ARN'] = configurationItem['arn']
+    configurationItem['configurationItemVersion'] = configurationItem['version']
+    if 'configuration' in configurationItem:
+        configurationItem['configuration'] = json.loads(configurationItem['configuration'])
+    for k, v in configurationItem.get('supplementaryConfiguration', {}).items():
+        try:
+            configurationItem['supplementaryConfiguration'][k] = json.loads(v)
+        except ValueError:
+            pass
+    configurationItem.setdefault('tags', {})
+    configurationItem.setdefault('relationships', [])
+    return configurationItem
+
+# List the resources of a type that Config has discovered, a page of up to 100 resource keys at a time, starting from nextToken.
+# Each page comes with the token it was fetched with, so that a sweep can resume from that page.
+def list_resource_keys(resourceType, context=None, nextToken=None):
+    kwargs = {'resourceType': resourceType}
+    while True:
+        if nextToken:
+            kwargs['nextToken'] = nextToken
+        response = call_with_retry(aws_config.list_discovered_resources, context, **kwargs)[0]
+        yield nextToken, [{'resourceType': resource['resourceType'], 'resourceId': resource['resourceId']} for resource in response.get('resourceIdentifiers', [])]
+        nextToken = response.get('nextToken')
+        if not nextToken:
+            return
+
+# Get the configuration items for up to 100 resource keys.  Keys that Config leaves unprocessed are asked for again.
+def get_configuration_items(resourceKeys, context=None):
+    configurationItems = []
+    attempt = 0
+    while resourceKeys:
+        response = call_with_retry(aws_config.batch_get_resource_config, context, resourceKeys=resourceKeys)[0]
+        configurationItems.extend(convert_base_configuration(item) for item in response.get('baseConfigurationItems', []))
+        resourceKeys = response.get('unprocessedResourceKeys', [])
+        if resourceKeys:
+            if attempt >= MAX_RETRIES:
+                print("Skipping {} resources that Config did not return configurations for.".format(len(resourceKeys)))
+                break
+            time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+            attempt += 1
+    return configurationItems
+
+def is_out_of_time(context):
+    remaining = get_remaining_seconds(context)
+    return remaining is not None and remaining < SWEEP_TIME_BUFFER
+
+# Log a shard's progress as a JSON line, for `rdk logs --sweeps` to pick up.
+def log_sweep_shard(sweep, status, started, summary, cursor=None):
+    print(json.dumps({'rdkSweep': {
+        'sweepId': sweep['sweepId'],
+        'shard': sweep['shard'],
+        'status': status,
+        'sweepStartedAt': sweep['startedAt'],
+        'startedAt': started,
+        'seconds': round(time.time() - started, 3),
+        'resources': summary['resources'],
+        'evaluations': summary['evaluations'],
+        'errors': summary['errors'],
+        'dropped': summary['dropped'],
+        'cursor': cursor
+    }}))
+
+# Hand the rest of a sweep to a new invocation of this function, with the original event and the cursor to resume from.
+def continue_sweep(event, scheduledInvokingEvent, sweep, cursor, context):
+    nextSweep = dict(sweep, shard=sweep['shard'] + 1, cursor=cursor)
+    payload = dict(event, invokingEvent=scheduledInvokingEvent, rdkSweep=nextSweep)
+    call_with_retry(aws_lambda.invoke, context, FunctionName=context.invoked_function_arn, InvocationType='Event', Payload=json.dumps(payload))
+
+# Evaluate every discovered resource of the rule's resource types, for a ScheduledNotification.  Evaluations are reported as they
+# fill a PutEvaluations call.  When the Lambda function is about to run out of time, the sweep reports what it has evaluated,
+# checkpoints the page and resource it has reached, and re-invokes the function to carry on from there.  Every shard reports with the scheduled notification's creation time as the
+# OrderingTimestamp and uses its result token, so the whole sweep reads to Config as one evaluation.
+def sweep_resources(lambda_handler, event, invokingEvent, context, timer=None):
+    timer = timer or PhaseTimer()
+    started = time.time()
+    scheduledInvokingEvent = event['invokingEvent']
+    sweep = event.get('rdkSweep') or {'sweepId': invokingEvent['notificationCreationTime'], 'shard': 0, 'startedAt': started, 'cursor': None}
+    cursor = dict({'typeIndex': 0, 'nextToken': None, 'resourceIndex': 0}, **(sweep['cursor'] or {}))
+    resourceTypes = [resourceType.strip() for resourceType in os.environ.get(RESOURCE_TYPES_VARIABLE, '').split(',') if resourceType.strip()]
+    if not resourceTypes:
+        print("There are no resource types to sweep, since " + RESOURCE_TYPES_VARIABLE + " is not set.")
+    resultToken = event['resultToken']
+    testMode = resultToken == 'TESTMODE'
+    orderingTimestamp = invokingEvent['notificationCreationTime']
+    metrics = {'evaluations': 0, 'calls': 0, 'retries': 0, 'dropped': 0}
+    summary = {'resources': 0, 'evaluations': 0, 'errors': 0, 'dropped': 0}
+    evaluations = []
+    nextCursor = None
+    skippedKeys = cursor['resourceIndex']
+    for typeIndex in range(cursor['typeIndex'], len(resourceTypes)):
+        resourceType = resourceTypes[typeIndex]
+        nextToken = cursor['nextToken'] if typeIndex == cursor['typeIndex'] else None
+        phaseStarted = time.time()
+        for pageToken, resourceKeys in list_resource_keys(resourceType, context, nextToken):
+            # A resumed sweep skips the resources of its first page that the previous shard already evaluated.
+            firstIndex = skippedKeys
+            resourceKeys = resourceKeys[firstIndex:]
+            skippedKeys = 0
+            if is_out_of_time(context):
+                nextCursor = {'typeIndex': typeIndex, 'nextToken': pageToken, 'resourceIndex': firstIndex}
+                break
+            configurationItems = dict(((item['resourceType'], item['resourceId']), item) for item in get_configuration_items(resourceKeys, context))
+            timer.add('ConfigurationFetch', phaseStarted)
+            phaseStarted = time.time()
+            for resourceIndex, resourceKey in enumerate(resourceKeys, firstIndex):
+                # Evaluating a page can take a while, so the time left is checked before each resource.
+                if is_out_of_time(context):
+                    nextCursor = {'typeIndex': typeIndex, 'nextToken': pageToken, 'resourceIndex': resourceIndex}
+                    break
+                configurationItem = configurationItems.get((resourceKey['resourceType'], resourceKey['resourceId']))
+                if configurationItem is None:
+                    continue
+                summary['resources'] += 1
+                invokingEvent['configurationItem'] = configurationItem
+                event['invokingEvent'] = json.dumps(invokingEvent, default=str)
+                compliance = 'NOT_APPLICABLE'
+                try:
+                    if is_applicable(configurationItem, event):
+                        compliance = lambda_handler(event, context)
+                except Exception:
+                    print("Could not evaluate {} {}: {}".format(resourceType, configurationItem['resourceId'], traceback.format_exc()))
+                    summary['errors'] += 1
+                    continue
+                for evaluation in build_evaluations(compliance, configurationItem):
+                    evaluation['OrderingTimestamp'] = orderingTimestamp
+                    evaluations.append(evaluation)
+            timer.add('Evaluate', phaseStarted)
+            phaseStarted = time.time()
+            if len(evaluations) >= MAX_EVALUATIONS_PER_CALL:
+                summary['evaluations'] += len(evaluations)
+                summary['dropped'] += report_evaluations(evaluations, resultToken, testMode, context, metrics)
+                evaluations = []
+                timer.add('PutEvaluations', phaseStarted)
+                phaseStarted = time.time()
+            if nextCursor:
+                break
+        if nextCursor:
+            break
+    phaseStarted = time.time()
+    summary['evaluations'] += len(evaluations)
+    summary['dropped'] += report_evaluations(evaluations, resultToken, testMode, context, metrics)
+    timer.add('PutEvaluations', phaseStarted)
+    log_put_metrics(metrics)
+
+    status = 'complete'
+    if nextCursor:
+        # A shard that could not get through a single page would hand the same cursor on forever.
+        if nextCursor == cursor and summary['resources'] == 0:
+            print("Stopping the sweep, since there was not enough time left to evaluate any resources.")
+            status = 'stopped'
+        elif not hasattr(context, 'invoked_function_arn'):
+            print("Stopping the sweep, since there is no function to continue it in.")
+            status = 'stopped'
+        else:
+            continue_sweep(event, scheduledInvokingEvent, sweep, nextCursor, context)
+            status = 'continued'
+    log_sweep_shard(sweep, status, started, summary, nextCursor)
+    log_metrics(timer, event)
+    if testMode:
+        report_cold_start()
+    return dict(summary, status=status, shard=sweep['shard'])
+
+# Log the phase timings of an invocation in CloudWatch embedded metric format, with its configuration cache hits and misses
+# when it used the cache.
+def log_metrics(timer, event):
+    if not EMIT_METRICS:
+        return
+    timer.phases['Total'] = (time.time() - timer.started) * 1000
+    counts = collections.OrderedDict()
+    cacheHits = configuration_cache.hits - timer.cacheHits
+    cacheMisses = configuration_cache.misses - timer.cacheMisses
+    if cacheHits or cacheMisses:
+        counts['ConfigurationCacheHits'] = cacheHits
+        counts['ConfigurationCacheMisses'] = cacheMisses
+    metrics = collections.OrderedDict()
+    metrics['_aws'] = {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': METRICS_NAMESPACE,
+            'Dimensions': [['RuleName']],
+            'Metrics': [{'Name': phase + 'Time', 'Unit': 'Milliseconds'} for phase in timer.phases] + [{'Name': name, 'Unit': 'Count'} for name in counts]
+        }]
+    }
+    metrics['RuleName'] = event.get('configRuleName', '')
+    for phase, milliseconds in timer.phases.items():
+        metrics[phase + 'Time'] = round(milliseconds, 3)
+    metrics.update(counts)
+    print(json.dumps(metrics))
+
+# Print how the cold start compared with the budget, once per container.
+def report_cold_start():
+    global cold_start_reported
+    if cold_start_reported:
+        return
+    cold_start_reported = True
+    cold_start_ms = (first_invocation - IMPORT_STARTED + aws_config.init_duration) * 1000
+    print("Cold start: {:.1f} ms from rule_util import to first invocation, {:.1f} ms creating the Config client, {:.1f} ms of the {} ms budget{}".format(
+        (first_invocation - IMPORT_STARTED) * 1000,
+        aws_config.init_duration * 1000,
+        cold_start_ms,
+        COLD_START_BUDGET_MS,
+        " - OVER BUDGET" if cold_start_ms > COLD_START_BUDGET_MS else ""))
+
 # This decorates the lambda_handler in rule_code with the actual PutEvaluation call
 def rule_handler(lambda_handler):
     def handler_wrapper(event, context):
+        global first_invocation
+        if first_invocation is None:
+            first_invocation = time.time()
         #print(event)
+        timer = PhaseTimer()
         check_defined(event, 'event')
         invokingEvent = json.loads(event['invokingEvent'])
         ruleParameters = {}
         if 'ruleParameters' in event:
             ruleParameters = json.loads(event['ruleParameters'])
-        configurationItem = get_configuration_item(invokingEvent)
+        timer.add('Decode', timer.started)
+        started = time.time()
+        configurationItem = get_configuration_item(invokingEvent, context)
+        timer.add('ConfigurationFetch', started)
         if configurationItem is None:
-            print("RDK utility class does not yet support Scheduled Notifications.")
-            return ("Not_Applicable")
+            # A ScheduledNotification has no configuration item, so sweep all of the rule's resources instead.
+            return sweep_resources(lambda_handler, event, invokingEvent, context, timer)
+        started = time.time()
         invokingEvent['configurationItem'] = configurationItem
         event['invokingEvent'] = json.dumps(invokingEvent)
+        timer.add('Decode', started)
+        started = time.time()
         compliance = 'NOT_APPLICABLE'
         if is_applicable(configurationItem, event):
             # Invoke the compliance checking function.
             compliance = lambda_handler(event, context)
+        timer.add('Evaluate', started)
         # Put together the request that reports the evaluation status
-        evaluations = [{
-                'ComplianceResourceType': configurationItem['resourceType'],
-                'ComplianceResourceId': configurationItem['resourceId'],
-                'ComplianceType': compliance,
-                'OrderingTimestamp': configurationItem['configurationItemCaptureTime']
-        }]
+        started = time.time()
+        evaluations = build_evaluations(compliance, configurationItem)
         resultToken = event['resultToken']
         testMode = False
         if resultToken == 'TESTMODE':
             # Used solely for RDK test to skip actual put_evaluation API call
             testMode = True
         # Invoke the Config API to report the result of the evaluation
-        aws_config.put_evaluations(Evaluations=evaluations, ResultToken=resultToken, TestMode=testMode)
+        report_evaluations(evaluations, resultToken, testMode, context)
+        timer.add('PutEvaluations', started)
+        log_metrics(timer, event)
+        if testMode:
+            report_cold_start()
         # Used solely for RDK test to be able to test Lambda function
         return compliance
     return handler_wrapper
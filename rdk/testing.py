@@ -0,0 +1,526 @@
+#    Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+#
+#        http://aws.amazon.com/apache2.0/
+#
+#    or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+import os
+import sys
+import re
+import imp
+import json
+import time
+import math
+import mmap
+import uuid
+import hashlib
+import cProfile
+import traceback
+import multiprocessing
+from datetime import datetime
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+def get_worker_context():
+    #Forked workers would inherit everything the CLI has imported, so start them from a clean interpreter where possible.
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('spawn')
+    return multiprocessing
+
+def load_rule_module(rule_test):
+    #Returns the rule's module, and the recorder standing in for its Config client if the rule is to be invoked.
+    if rule_test['region'] and not os.environ.get('AWS_DEFAULT_REGION'):
+        os.environ['AWS_DEFAULT_REGION'] = rule_test['region']
+    sys.path.insert(0, os.path.dirname(rule_test['module_path']))
+
+    #The rule's own rule_util has to be in place before the rule imports it.  Dropping the previous one gives each rule a fresh copy.
+    util_name = os.path.splitext(os.path.basename(rule_test['util_path']))[0]
+    sys.modules.pop(util_name, None)
+    util_module = imp.load_source(util_name, rule_test['util_path'])
+    module = imp.load_source(str(rule_test['rule_name']).lower(), rule_test['module_path'])
+    if rule_test['event_template'] is None:
+        return module, None
+
+    recorder = LocalConfigRecorder()
+    if hasattr(util_module.aws_config, 'get_client'):
+        #Current templates create the Config client lazily, so fill in the client before it is first used.  The rule shares the same LazyClient through its import of rule_util.
+        util_module.aws_config.client = recorder
+    else:
+        #Rules created from older templates hold a boto3 client that has to be swapped out.
+        util_module.aws_config = recorder
+        if hasattr(module, 'aws_config'):
+            module.aws_config = recorder
+    return module, recorder
+
+def build_test_event(event_template, my_ci, rule_parameters):
+    #Wrap a CI in an event like the ones Config sends to a rule's Lambda function.
+    test_event = dict(event_template)
+    my_invoking_event = json.loads(test_event['invokingEvent'])
+    my_invoking_event['configurationItem'] = my_ci
+    my_invoking_event['notificationCreationTime'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    test_event['invokingEvent'] = json.dumps(my_invoking_event)
+    test_event['ruleParameters'] = rule_parameters or '{}'
+
+    #The CI is being tested, so it is in scope, and the TESTMODE token tells rule_util the evaluations are only a test.
+    test_event['eventLeftScope'] = False
+    test_event['resultToken'] = 'TESTMODE'
+    return test_event
+
+def evaluate_rule_ci(module, recorder, rule_test, my_ci):
+    #Returns the rule's compliance result for the CI, and the evaluations it reported if it was invoked through its handler.
+    if recorder is None:
+        return str(module.evaluate_compliance(my_ci, rule_test['parameters'])), None
+
+    recorder.evaluations = []
+    test_event = build_test_event(rule_test['event_template'], my_ci, rule_test['parameters'])
+    my_context = LocalLambdaContext(rule_test['rule_name'], rule_test['lambda_settings'])
+    compliance = getattr(module, rule_test['handler'])(test_event, my_context)
+    return str(compliance), recorder.evaluations
+
+#The rules loaded into a --ci-stream worker process, as (rule_test, module, recorder) tuples, and any error loading them.
+_stream_rules = []
+_stream_load_errors = []
+_stream_progress = None
+
+def init_ci_stream_worker(rule_tests, progress):
+    global _stream_progress
+    #Anything the rules print goes to stderr, since stdout may be carrying the results.
+    sys.stdout = sys.stderr
+    _stream_progress = progress
+    for rule_test in rule_tests:
+        try:
+            module, recorder = load_rule_module(rule_test)
+            _stream_rules.append((rule_test, module, recorder))
+        except (Exception, SystemExit):
+            #A pool keeps replacing workers whose initializer fails, so report the error from the first batch instead.
+            _stream_load_errors.append("Could not load " + rule_test['rule_name'] + ": " + traceback.format_exc().strip().splitlines()[-1])
+
+def evaluate_ci_batch(lines):
+    #Returns a result record for each rule each CI is in scope for, and an error record for each line that isn't a CI.
+    if _stream_load_errors:
+        raise Exception(_stream_load_errors[0])
+
+    records = []
+    _stream_progress.value = time.time()
+    for line in lines:
+        try:
+            my_ci = json.loads(line.decode('utf-8'))
+            resource_type = my_ci['resourceType']
+        except (ValueError, KeyError, TypeError) as e:
+            records.append({'error': "Could not read CI: " + str(e)})
+            continue
+
+        for rule_test, module, recorder in _stream_rules:
+            #Config only sends a rule the resource types it is scoped to.
+            if rule_test['source_events'] and resource_type not in rule_test['source_events']:
+                continue
+
+            record = {'rule': rule_test['rule_name'], 'resourceType': resource_type, 'resourceId': my_ci.get('resourceId')}
+            started = time.time()
+            try:
+                record['compliance'], evaluations = evaluate_rule_ci(module, recorder, rule_test, my_ci)
+                if evaluations is not None:
+                    record['evaluations'] = evaluations
+            except (Exception, SystemExit):
+                record['compliance'] = 'ERROR'
+                record['error'] = traceback.format_exc().strip().splitlines()[-1]
+            record['durationMs'] = round((time.time() - started) * 1000, 3)
+            records.append(record)
+            _stream_progress.value = time.time()
+
+    return records
+
+def run_rule_tests(rule_test, start_index, connection):
+    #Runs in a test worker process.  Each rule gets a fresh interpreter, so its rule_util module and Config client are its own.
+    try:
+        module, recorder = load_rule_module(rule_test)
+    except (Exception, SystemExit):
+        connection.send(('failed', start_index, "Could not load rule: " + traceback.format_exc()))
+        return
+
+    for index in range(start_index, len(rule_test['cis'])):
+        connection.send(('start', index))
+
+        #Capture anything the rule prints, so output from parallel rules doesn't interleave.
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        started = time.time()
+        compliance = None
+        evaluations = None
+        error = None
+        try:
+            compliance, evaluations = evaluate_rule_ci(module, recorder, rule_test, rule_test['cis'][index])
+        except (Exception, SystemExit):
+            error = traceback.format_exc()
+        finally:
+            output = sys.stdout.getvalue()
+            sys.stdout = stdout
+
+        connection.send(('result', index, {'compliance': compliance, 'evaluations': evaluations, 'error': error, 'output': output, 'duration': time.time() - started, 'timed_out': False}))
+
+    connection.send(('done',))
+
+def percentile(sorted_values, percent):
+    #Nearest-rank percentile of an already sorted list.
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+def benchmark_rule(rule_test, iterations, warmup, profile_path):
+    #Runs in a benchmark worker process.  Returns the rule's latency percentiles in milliseconds, the largest peak allocation of a
+    #single call, and a digest of the CIs used so that results are only compared with baselines taken on the same CIs.
+    timer = getattr(time, 'perf_counter', time.time)
+    try:
+        module, recorder = load_rule_module(rule_test)
+        #Fixtures are read up front, so that reading them isn't part of the timings.
+        my_cis = list(rule_test['cis'])
+        if not my_cis:
+            return {'error': "There are no test CIs to benchmark " + rule_test['rule_name'] + " with."}
+        ci_digest = hashlib.sha256(json.dumps(my_cis, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        sys.stdout = open(os.devnull, 'w')
+
+        for i in range(warmup):
+            for my_ci in my_cis:
+                evaluate_rule_ci(module, recorder, rule_test, my_ci)
+
+        timings = []
+        for i in range(iterations):
+            for my_ci in my_cis:
+                started = timer()
+                evaluate_rule_ci(module, recorder, rule_test, my_ci)
+                timings.append((timer() - started) * 1000)
+
+        #Tracing allocations slows everything down, so it gets its own pass rather than skewing the timings.  Tracing is restarted
+        #for every call, so each peak belongs to a single call.
+        peak_memory = None
+        if tracemalloc is not None:
+            peaks = []
+            for my_ci in my_cis:
+                tracemalloc.start()
+                evaluate_rule_ci(module, recorder, rule_test, my_ci)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            peak_memory = max(peaks) if peaks else 0
+
+        if profile_path:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            for i in range(iterations):
+                for my_ci in my_cis:
+                    evaluate_rule_ci(module, recorder, rule_test, my_ci)
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+    except (Exception, SystemExit):
+        return {'error': "Benchmark of " + rule_test['rule_name'] + " failed: " + traceback.format_exc()}
+
+    timings.sort()
+    return {
+        'calls': len(timings),
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'mean_ms': sum(timings) / len(timings),
+        'peak_memory_bytes': peak_memory,
+        'cis': len(my_cis),
+        'ci_digest': ci_digest
+    }
+
+class LocalConfigRecorder():
+    """Stands in for rule_util's AWS Config client when a rule is invoked locally.
+
+    put_evaluations checks its arguments the way Config does and records the evaluations.  Any other call fails, since
+    there is no Config service to answer it.
+    """
+    compliance_types = ['COMPLIANT', 'NON_COMPLIANT', 'NOT_APPLICABLE', 'INSUFFICIENT_DATA']
+    max_evaluations = 100
+
+    def __init__(self):
+        self.evaluations = []
+
+    def put_evaluations(self, Evaluations=None, ResultToken=None, TestMode=False):
+        Evaluations = Evaluations or []
+        if not ResultToken:
+            raise Exception("put_evaluations was called without a ResultToken.")
+        if len(Evaluations) > self.max_evaluations:
+            raise Exception("put_evaluations was called with " + str(len(Evaluations)) + " evaluations, but Config accepts at most " + str(self.max_evaluations) + ".")
+
+        for evaluation in Evaluations:
+            for key in ['ComplianceResourceType', 'ComplianceResourceId', 'ComplianceType', 'OrderingTimestamp']:
+                if not evaluation.get(key):
+                    raise Exception("put_evaluations was called with an evaluation that has no " + key + ": " + str(evaluation))
+            if evaluation['ComplianceType'] not in self.compliance_types:
+                raise Exception("put_evaluations was called with ComplianceType " + str(evaluation['ComplianceType']) + ", which must be one of " + ", ".join(self.compliance_types) + ".")
+            self.evaluations.append(evaluation)
+
+        return {'FailedEvaluations': []}
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def unavailable(*args, **kwargs):
+            raise Exception("The Config " + name + " call is not available when invoking rules locally.")
+        return unavailable
+
+class LocalLambdaContext():
+    """Stands in for the context object Lambda passes to a rule's handler."""
+    def __init__(self, rule_name, lambda_settings):
+        self.function_name = 'RDK-Rule-Function-' + rule_name
+        self.function_version = '$LATEST'
+        self.invoked_function_arn = 'arn:aws:lambda:local:123456789012:function:' + self.function_name
+        self.memory_limit_in_mb = lambda_settings['memory_size']
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = '/aws/lambda/' + self.function_name
+        self.log_stream_name = 'local'
+        self.deadline = time.time() + lambda_settings['timeout']
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self.deadline - time.time()) * 1000), 0)
+
+class LocalTestRunner():
+    """Runs rules' evaluate_compliance functions against their test CIs in worker processes.
+
+    Each rule is loaded into a fresh process.  A CI that runs for longer than the timeout has its worker killed, and the
+    rule carries on with its next CI in a new worker.  Once every CI for a rule has a result, report is called with the
+    rule's test and its list of results, in CI order.
+    """
+    def __init__(self, processes, timeout, report):
+        self.processes = processes
+        self.timeout = timeout
+        self.report = report
+        self.context = get_worker_context()
+
+    def run(self, rule_tests):
+        #Returns a dict of rule name to the list of results for that rule's CIs.
+        results = dict((rule_test['rule_name'], [None] * len(rule_test['cis'])) for rule_test in rule_tests)
+        pending = [(rule_test, 0) for rule_test in rule_tests]
+        workers = []
+        try:
+            while pending or workers:
+                while pending and len(workers) < self.processes:
+                    rule_test, start_index = pending.pop(0)
+                    workers.append(self.__start_worker(rule_test, start_index))
+
+                busy = False
+                for worker in list(workers):
+                    try:
+                        while worker['connection'].poll():
+                            busy = True
+                            if self.__handle_message(worker, worker['connection'].recv(), results):
+                                self.__finish_worker(worker, workers, pending, results)
+                                break
+                        else:
+                            if worker['started'] is not None and time.time() - worker['started'] > self.timeout:
+                                self.__record_failure(worker, results, "Timed out after " + str(self.timeout) + " seconds.", True)
+                                self.__finish_worker(worker, workers, pending, results)
+                    except EOFError:
+                        #The worker went away without saying it was done.
+                        worker['process'].join()
+                        self.__record_failure(worker, results, "Worker process exited with code " + str(worker['process'].exitcode) + ".", False)
+                        self.__finish_worker(worker, workers, pending, results)
+
+                if not busy:
+                    time.sleep(0.01)
+        finally:
+            for worker in workers:
+                worker['process'].terminate()
+
+        return results
+
+    def __start_worker(self, rule_test, start_index):
+        receiver, sender = self.context.Pipe(False)
+        process = self.context.Process(target=run_rule_tests, args=(rule_test, start_index, sender))
+        process.daemon = True
+        process.start()
+        sender.close()
+        return {'rule_test': rule_test, 'process': process, 'connection': receiver, 'index': start_index, 'started': None, 'done': False}
+
+    def __handle_message(self, worker, message, results):
+        #Returns True once the worker has nothing more to do.
+        rule_name = worker['rule_test']['rule_name']
+        if message[0] == 'start':
+            worker['index'] = message[1]
+            worker['started'] = time.time()
+        elif message[0] == 'result':
+            results[rule_name][message[1]] = message[2]
+            worker['index'] = message[1] + 1
+            worker['started'] = None
+        elif message[0] == 'failed':
+            #The rule couldn't be loaded, so none of its remaining CIs can run.
+            for index in range(message[1], len(results[rule_name])):
+                results[rule_name][index] = {'compliance': None, 'error': message[2], 'output': '', 'duration': 0, 'timed_out': False}
+            worker['done'] = True
+            return True
+        elif message[0] == 'done':
+            worker['done'] = True
+            return True
+
+        return False
+
+    def __record_failure(self, worker, results, error, timed_out):
+        #The CI the worker was running when it was killed or died is recorded as failed, and the rest are retried.
+        rule_name = worker['rule_test']['rule_name']
+        if worker['index'] < len(results[rule_name]):
+            results[rule_name][worker['index']] = {'compliance': None, 'error': error, 'output': '', 'duration': 0, 'timed_out': timed_out}
+        worker['index'] = worker['index'] + 1
+
+    def __finish_worker(self, worker, workers, pending, results):
+        workers.remove(worker)
+        if worker['process'].is_alive() and not worker['done']:
+            worker['process'].terminate()
+        worker['process'].join()
+        worker['connection'].close()
+
+        rule_test = worker['rule_test']
+        if not worker['done'] and worker['index'] < len(rule_test['cis']):
+            pending.insert(0, (rule_test, worker['index']))
+        else:
+            self.report(rule_test, results[rule_test['rule_name']])
+
+class TestCIFixtures():
+    """The CIs in a rule's test fixtures, read lazily through an index of where each CI sits in its file.
+
+    A fixture file may hold a JSON array of CIs, a single CI, or one CI per line.  The index records the byte range and
+    resource type of every CI, so CIs can be filtered by type and are only parsed when they are used.
+    """
+    #Strings (with their escapes) and the structural characters are all the scanner needs to find each CI.
+    token_pattern = re.compile(br'"(?:[^"\\]|\\.)*"|[\[\]{}:,]')
+    resource_type_pattern = re.compile(br'"resourceType"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+    def __init__(self, entries):
+        #Each entry is a (path, start offset, end offset, resource type) tuple.
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        path, start, end, resource_type = self.entries[index]
+        with open(path, 'rb') as fixture_file:
+            return self.__read_ci(fixture_file, start, end)
+
+    def __iter__(self):
+        #Consecutive CIs usually come from the same file, which is only kept open while its CIs are being read.
+        fixture_file = None
+        try:
+            for path, start, end, resource_type in self.entries:
+                if fixture_file is None or fixture_file.name != path:
+                    if fixture_file is not None:
+                        fixture_file.close()
+                    fixture_file = open(path, 'rb')
+                yield self.__read_ci(fixture_file, start, end)
+        finally:
+            if fixture_file is not None:
+                fixture_file.close()
+
+    def __read_ci(self, fixture_file, start, end):
+        fixture_file.seek(start)
+        return json.loads(fixture_file.read(end - start).decode('utf-8'))
+
+    def filter(self, resource_types):
+        return TestCIFixtures([entry for entry in self.entries if entry[3] in resource_types])
+
+    @classmethod
+    def index_file(cls, path):
+        #Returns a (start offset, end offset, resource type) tuple for each CI in the file.
+        if os.path.getsize(path) == 0:
+            return []
+
+        entries = cls.__index_lines(path)
+        if entries is None:
+            entries = cls.__index_tokens(path)
+
+        return entries
+
+    @classmethod
+    def __index_lines(cls, path):
+        #The fast path, for files with one CI per line (or an array with one CI per line).  Returns None for any other layout.
+        entries = []
+        offset = 0
+        with open(path, 'rb') as fixture_file:
+            for line in fixture_file:
+                line_offset = offset
+                offset = offset + len(line)
+                ci_json = line.strip().rstrip(b',')
+                if ci_json in (b'', b'[', b']'):
+                    continue
+                if ci_json[:1] != b'{' or ci_json[-1:] != b'}':
+                    return None
+
+                #A CI's relationships and configuration can have resource types too, so a match is only trusted without parsing if it is the only one and is one of the CI's own keys.
+                type_matches = list(cls.resource_type_pattern.finditer(ci_json))
+                if len(type_matches) == 1 and cls.__get_depth(ci_json[:type_matches[0].start()]) == 1:
+                    resource_type = json.loads(type_matches[0].group(1).decode('utf-8'))
+                elif type_matches:
+                    resource_type = json.loads(ci_json.decode('utf-8')).get('resourceType')
+                else:
+                    resource_type = None
+
+                start = line_offset + line.index(b'{')
+                entries.append((start, start + len(ci_json), resource_type))
+
+        return entries
+
+    @classmethod
+    def __get_depth(cls, data):
+        #How deeply the end of data is nested, counting only the brackets outside of strings.
+        depth = 0
+        for match in cls.token_pattern.finditer(data):
+            token = match.group(0)
+            if token in (b'{', b'['):
+                depth = depth + 1
+            elif token in (b'}', b']'):
+                depth = depth - 1
+        return depth
+
+    @classmethod
+    def __index_tokens(cls, path):
+        #Finds each CI by scanning the file's strings and structural characters, without parsing any of them.
+        entries = []
+        with open(path, 'rb') as fixture_file:
+            data = mmap.mmap(fixture_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                #CIs are the top-level objects, unless the file is an array, in which case they are its elements.
+                ci_depth = None
+                depth = 0
+                start = None
+                resource_type = None
+                last_string = None
+                in_type_value = False
+                for match in cls.token_pattern.finditer(data):
+                    token = match.group(0)
+                    if ci_depth is None:
+                        ci_depth = 1 if token == b'[' else 0
+
+                    if token[:1] == b'"':
+                        #Only the CI's own resourceType counts, not those of its relationships or configuration.
+                        if depth == ci_depth + 1:
+                            if in_type_value:
+                                resource_type = json.loads(token.decode('utf-8'))
+                            last_string = token
+                        in_type_value = False
+                        continue
+
+                    in_type_value = token == b':' and depth == ci_depth + 1 and last_string == b'"resourceType"'
+                    last_string = None
+                    if token in (b'{', b'['):
+                        if token == b'{' and depth == ci_depth:
+                            start = match.start()
+                            resource_type = None
+                        depth = depth + 1
+                    elif token in (b'}', b']'):
+                        depth = depth - 1
+                        if token == b'}' and depth == ci_depth and start is not None:
+                            entries.append((start, match.end(), resource_type))
+                            start = None
+            finally:
+                data.close()
+
+        return entries
@@ -0,0 +1,61 @@
+#    Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+#
+#        http://aws.amazon.com/apache2.0/
+#
+#    or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+import os
+import json
+import shutil
+import argparse
+import boto3
+import pytest
+from botocore.stub import Stubber
+from rdk import rdk
+
+#Clients are only ever used through a Stubber, so nothing here reaches AWS.
+test_region = 'us-east-1'
+test_account_id = '123456789012'
+
+def make_client(service):
+    client = boto3.client(service, region_name=test_region, aws_access_key_id='testing', aws_secret_access_key='testing')
+    return client, Stubber(client)
+
+def write_rule(workspace, rule_name, runtime='python3.6'):
+    rule_path = os.path.join(workspace, rule_name)
+    os.mkdir(rule_path)
+    with open(os.path.join(rule_path, rule_name + '.py'), 'w') as rule_file:
+        rule_file.write("def lambda_handler(event, context):\n    return 'COMPLIANT'\n")
+    parameters = {
+        'RuleName': rule_name,
+        'SourceRuntime': runtime,
+        'CodeKey': rule_name + '.zip',
+        'InputParameters': '{}',
+        'SourceEvents': 'AWS::EC2::Instance',
+        'SourcePeriodic': 'TwentyFour_Hours'
+    }
+    with open(os.path.join(rule_path, 'parameters.json'), 'w') as parameters_file:
+        json.dump({'Parameters': parameters}, parameters_file)
+    return rule_path
+
+@pytest.fixture
+def workspace(tmpdir, monkeypatch):
+    #An rdk working directory with two python rules in it.
+    workspace = str(tmpdir)
+    shutil.copytree(os.path.join(os.path.dirname(rdk.__file__), 'template'), os.path.join(workspace, '.rdk'))
+    write_rule(workspace, 'RuleA')
+    write_rule(workspace, 'RuleB')
+    monkeypatch.chdir(workspace)
+    return workspace
+
+@pytest.fixture
+def make_rdk():
+    #Builds an rdk for a command, with the given service clients in place of ones it would create itself.
+    def make(command, command_args, clients=None):
+        args = argparse.Namespace(profile=None, access_key_id='testing', secret_access_key='testing', region=test_region, command=command, command_args=command_args, cache_ttl=0)
+        my_rdk = rdk.rdk(args)
+        my_rdk._rdk__clients.update(clients or {})
+        return my_rdk
+    return make
@@ -0,0 +1,84 @@
+#    Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+#
+#        http://aws.amazon.com/apache2.0/
+#
+#    or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+from rdk.cfn import CfnTemplateLocalizer
+
+def make_localizer():
+    return CfnTemplateLocalizer({'SourceBucket': 'my-bucket', 'SourceEvents': ['AWS::EC2::Instance']}, ['Role', 'Function', 'HasLayers'], 'RuleA')
+
+def test_localize_ref():
+    localizer = make_localizer()
+
+    assert localizer.localize({'Ref': 'SourceBucket'}) == 'my-bucket'
+    assert localizer.localize({'Ref': 'SourceEvents'}) == ['AWS::EC2::Instance']
+    assert localizer.localize({'Ref': 'Role'}) == {'Ref': 'RoleRuleA'}
+    assert localizer.localize({'Ref': 'AWS::Region'}) == {'Ref': 'AWS::Region'}
+    assert localizer.localize({'Fn::GetAtt': ['Role', 'Arn']}) == {'Fn::GetAtt': ['RoleRuleA', 'Arn']}
+
+def test_localize_sub():
+    localizer = make_localizer()
+
+    assert localizer.localize({'Fn::Sub': 'arn:aws:s3:::${SourceBucket}/${Function.Arn}/${AWS::Region}/${!Literal}'}) == \
+        {'Fn::Sub': 'arn:aws:s3:::my-bucket/${FunctionRuleA.Arn}/${AWS::Region}/${!Literal}'}
+    #List parameters can't be substituted into a string, so they are left for CloudFormation.
+    assert localizer.localize({'Fn::Sub': '${SourceEvents}'}) == {'Fn::Sub': '${SourceEvents}'}
+    assert localizer.localize({'Fn::Sub': ['${Role}-${Name}', {'Name': {'Ref': 'SourceBucket'}}]}) == \
+        {'Fn::Sub': ['${RoleRuleA}-${Name}', {'Name': 'my-bucket'}]}
+
+def test_localize_conditions():
+    localizer = make_localizer()
+    resource = {
+        'Type': 'AWS::Lambda::Function',
+        'Condition': 'HasLayers',
+        'DependsOn': ['Role', 'Other'],
+        'Properties': {
+            'Layers': {'Fn::If': ['HasLayers', [{'Ref': 'SourceBucket'}], {'Ref': 'AWS::NoValue'}]},
+            'Role': {'Fn::GetAtt': ['Role', 'Arn']}
+        }
+    }
+
+    assert localizer.localize(resource) == {
+        'Type': 'AWS::Lambda::Function',
+        'Condition': 'HasLayersRuleA',
+        'DependsOn': ['RoleRuleA', 'Other'],
+        'Properties': {
+            'Layers': {'Fn::If': ['HasLayersRuleA', ['my-bucket'], {'Ref': 'AWS::NoValue'}]},
+            'Role': {'Fn::GetAtt': ['RoleRuleA', 'Arn']}
+        }
+    }
+    assert localizer.localize({'Fn::And': [{'Condition': 'HasLayers'}, {'Fn::Equals': [{'Ref': 'SourceBucket'}, '']}]}) == \
+        {'Fn::And': [{'Condition': 'HasLayersRuleA'}, {'Fn::Equals': ['my-bucket', '']}]}
+
+def build_combined_template(my_rdk, rule_names, deployed_template=None, kept_rules=None):
+    my_deploys = []
+    for rule_name in rule_names:
+        my_rule_params = my_rdk._rdk__get_rule_parameters(rule_name)
+        my_deploys.append({
+            'rule_name': rule_name,
+            'cfn_params': my_rdk._rdk__get_cfn_parameters(rule_name, my_rule_params, 'my-bucket', rule_name + '/' + rule_name + '.zip')
+        })
+    return my_rdk._rdk__build_combined_template(my_deploys, deployed_template, kept_rules)
+
+def test_combined_template_keeps_rules_as_deployed(workspace, make_rdk):
+    my_rdk = make_rdk('deploy', [])
+    deployed_template = build_combined_template(my_rdk, ['RuleA', 'RuleB'])
+    #The deployed copy of RuleB differs from what would be built from the working directory now.
+    deployed_template['Resources']['rdkRuleCodeLambdaRuleB']['Properties']['Timeout'] = 123
+
+    kept_rules = my_rdk._rdk__get_combined_stack_rules(deployed_template)
+    assert kept_rules == {'RuleA': 'RuleA', 'RuleB': 'RuleB'}
+    del kept_rules['RuleA']
+    my_template = build_combined_template(my_rdk, ['RuleA'], deployed_template, kept_rules)
+
+    assert my_template['Metadata']['RdkRules'] == {'RuleA': 'RuleA', 'RuleB': 'RuleB'}
+    assert sorted(my_template['Resources']) == sorted(deployed_template['Resources'])
+    for section in ['Conditions', 'Resources', 'Outputs']:
+        for logical_id in deployed_template[section]:
+            if logical_id.endswith('RuleB'):
+                assert my_template[section][logical_id] == deployed_template[section][logical_id]
+    assert my_template['Resources']['rdkRuleCodeLambdaRuleA']['Properties']['Code']['S3Bucket'] == 'my-bucket'
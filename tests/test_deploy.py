@@ -0,0 +1,118 @@
+#    Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+#
+#        http://aws.amazon.com/apache2.0/
+#
+#    or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+import os
+import datetime
+import threading
+import pytest
+from botocore.exceptions import ClientError
+from rdk import rdk
+from rdk.deploy import DeployPipeline
+from .conftest import make_client, test_account_id
+
+def test_pipeline_drops_items_that_fail_a_stage():
+    messages = []
+    published = []
+
+    def build(item):
+        if item == 'bad':
+            return "build failed"
+        if item == 'broken':
+            raise Exception("build crashed")
+        return None
+
+    def publish(item):
+        published.append(item)
+        return None
+
+    pipeline = DeployPipeline([('build', build, 2), ('publish', publish, 1)], lambda name, message: messages.append((name, message)))
+    results = pipeline.run(['good', 'bad', 'broken'], lambda item: item)
+
+    assert results == {'good': None, 'bad': "build failed", 'broken': "build crashed"}
+    assert published == ['good']
+    assert ('broken', "Error during build: build crashed") in messages
+    assert len(pipeline.timings['build']) == 3
+    assert [timing[0] for timing in pipeline.timings['publish']] == ['good']
+
+def stub_caller_identity():
+    sts, stubber = make_client('sts')
+    stubber.add_response('get_caller_identity', {'Account': test_account_id}, {})
+    stubber.activate()
+    return sts
+
+def run_deploy(make_rdk, command_args):
+    #Deploys through a stand-in pipeline that records which rules reached it, and marks them deployed.
+    deployed = []
+    my_rdk = make_rdk('deploy', command_args, {'sts': stub_caller_identity()})
+
+    def run_deploy_pipeline(stages, my_deploys):
+        for my_deploy in my_deploys:
+            deployed.append(my_deploy['rule_name'])
+            my_rdk._rdk__update_manifest(rdk.deploy_manifest_filename, my_deploy['rule_name'], my_deploy['rule_hash'])
+        return dict((my_deploy['rule_name'], None) for my_deploy in my_deploys)
+
+    my_rdk._rdk__run_deploy_pipeline = run_deploy_pipeline
+    assert my_rdk.process_command() == 0
+    return deployed
+
+def test_deploy_skips_unchanged_rules(workspace, make_rdk):
+    assert sorted(run_deploy(make_rdk, ['--all'])) == ['RuleA', 'RuleB']
+    assert run_deploy(make_rdk, ['--all']) == []
+
+    with open(os.path.join(workspace, 'RuleB', 'RuleB.py'), 'a') as rule_file:
+        rule_file.write("# changed\n")
+    assert run_deploy(make_rdk, ['--all']) == ['RuleB']
+
+def test_deploy_force_deploys_unchanged_rules(workspace, make_rdk):
+    assert run_deploy(make_rdk, ['RuleA']) == ['RuleA']
+    assert run_deploy(make_rdk, ['RuleA', '--force']) == ['RuleA']
+
+def make_stack_deploy(make_rdk, cfn):
+    my_rdk = make_rdk('deploy', [], {'cloudformation': cfn})
+    my_rdk._rdk__stack_slots = threading.BoundedSemaphore(1)
+    my_deploy = {'rule_name': 'RuleA', 'cfn_params': [{'ParameterKey': 'SourceBucket', 'ParameterValue': 'bucket'}]}
+    return my_rdk, my_deploy
+
+def stack_description(stack_name):
+    return {'Stacks': [{'StackName': stack_name, 'CreationTime': datetime.datetime(2017, 11, 15), 'StackStatus': 'CREATE_COMPLETE'}]}
+
+def test_stack_slot_released_when_update_fails(workspace, make_rdk):
+    cfn, stubber = make_client('cloudformation')
+    stubber.add_response('describe_stacks', stack_description('RuleA'), {'StackName': 'RuleA'})
+    stubber.add_client_error('update_stack', service_error_code='ValidationError', service_message='Template format error')
+    stubber.activate()
+    my_rdk, my_deploy = make_stack_deploy(make_rdk, cfn)
+
+    error = my_rdk._rdk__apply_rule_stack(my_deploy)
+
+    assert 'Template format error' in error
+    assert my_rdk._rdk__stack_slots.acquire(False)
+    stubber.assert_no_pending_responses()
+
+def test_stack_slot_released_when_create_raises(workspace, make_rdk):
+    cfn, stubber = make_client('cloudformation')
+    stubber.add_client_error('describe_stacks', service_error_code='ValidationError', service_message='Stack with id RuleA does not exist')
+    stubber.add_client_error('create_stack', service_error_code='AccessDenied', service_message='Not allowed')
+    stubber.activate()
+    my_rdk, my_deploy = make_stack_deploy(make_rdk, cfn)
+
+    with pytest.raises(ClientError):
+        my_rdk._rdk__apply_rule_stack(my_deploy)
+
+    assert my_rdk._rdk__stack_slots.acquire(False)
+
+def test_stack_slot_held_until_wait_when_operation_starts(workspace, make_rdk):
+    cfn, stubber = make_client('cloudformation')
+    stubber.add_response('describe_stacks', stack_description('RuleA'), {'StackName': 'RuleA'})
+    stubber.add_client_error('update_stack', service_error_code='ValidationError', service_message='No updates are to be performed.')
+    stubber.activate()
+    my_rdk, my_deploy = make_stack_deploy(make_rdk, cfn)
+
+    assert my_rdk._rdk__apply_rule_stack(my_deploy) is None
+    assert my_deploy['stack_exists']
+    assert not my_rdk._rdk__stack_slots.acquire(False)
@@ -0,0 +1,146 @@
+#    Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+#
+#        http://aws.amazon.com/apache2.0/
+#
+#    or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+import os
+import json
+import pytest
+from botocore.exceptions import ClientError
+from rdk import logs
+from rdk.logs import LogTailer, LogArchive, merge_log_events, parse_log_metrics
+from .conftest import make_client
+
+log_group_name = '/aws/lambda/RDK-Rule-Function-RuleA'
+
+def make_event(event_id, timestamp, message=None):
+    return {'eventId': event_id, 'timestamp': timestamp, 'ingestionTime': timestamp, 'logStreamName': 'stream', 'message': message or event_id}
+
+def expect_filter(stubber, start_time, events, next_token=None, request_token=None):
+    response = {'events': events}
+    if next_token:
+        response['nextToken'] = next_token
+    expected_params = {'logGroupName': log_group_name, 'startTime': start_time}
+    if request_token:
+        expected_params['nextToken'] = request_token
+    stubber.add_response('filter_log_events', response, expected_params)
+
+def test_tailer_skips_events_seen_at_the_boundary():
+    client, stubber = make_client('logs')
+    expect_filter(stubber, 1000, [make_event('a', 1000), make_event('b', 2000)])
+    expect_filter(stubber, 2000, [make_event('b', 2000), make_event('c', 2000)])
+    expect_filter(stubber, 2000, [make_event('b', 2000), make_event('c', 2000)])
+    stubber.activate()
+    tailer = LogTailer(client, log_group_name, rule_name='RuleA', start_time=1000)
+
+    first_events = tailer.poll()
+    assert [event['eventId'] for event in first_events] == ['a', 'b']
+    assert first_events[0]['ruleName'] == 'RuleA'
+    assert first_events[0]['logGroupName'] == log_group_name
+    assert [event['eventId'] for event in tailer.poll()] == ['c']
+    assert tailer.poll() == []
+    assert tailer.interval == logs.log_poll_min_interval * logs.log_poll_backoff
+    stubber.assert_no_pending_responses()
+
+def test_tailer_starts_after_the_events_it_is_given():
+    #Events from get_log_events have no eventId, so they are recognized by their timestamp and message.
+    client, stubber = make_client('logs')
+    expect_filter(stubber, 2000, [make_event('x', 2000, 'shown'), make_event('y', 2000, 'late')])
+    stubber.activate()
+    tailer = LogTailer(client, log_group_name, events=[{'timestamp': 1000, 'message': 'old'}, {'timestamp': 2000, 'message': 'shown'}])
+
+    assert [event['message'] for event in tailer.poll()] == ['late']
+
+def test_tailer_waits_for_missing_log_group():
+    client, stubber = make_client('logs')
+    stubber.add_client_error('filter_log_events', service_error_code='ResourceNotFoundException', service_message='The specified log group does not exist.')
+    expect_filter(stubber, 1000, [make_event('a', 1500)])
+    stubber.activate()
+    tailer = LogTailer(client, log_group_name, start_time=1000)
+
+    assert tailer.poll() == []
+    assert tailer.interval == logs.log_poll_min_interval * logs.log_poll_backoff
+    assert [event['eventId'] for event in tailer.poll()] == ['a']
+    assert tailer.interval == logs.log_poll_min_interval
+
+def test_tailer_rereads_pages_after_throttling():
+    client, stubber = make_client('logs')
+    expect_filter(stubber, 1000, [make_event('a', 1500)], next_token='page2')
+    stubber.add_client_error('filter_log_events', service_error_code='ThrottlingException', service_message='Rate exceeded')
+    expect_filter(stubber, 1000, [make_event('a', 1500)], next_token='page2')
+    expect_filter(stubber, 1000, [make_event('b', 1600)], request_token='page2')
+    stubber.activate()
+    tailer = LogTailer(client, log_group_name, start_time=1000)
+
+    assert tailer.poll() == []
+    assert [event['eventId'] for event in tailer.poll()] == ['a', 'b']
+    stubber.assert_no_pending_responses()
+
+def test_tailer_raises_other_errors():
+    client, stubber = make_client('logs')
+    stubber.add_client_error('filter_log_events', service_error_code='AccessDeniedException', service_message='Not allowed')
+    stubber.activate()
+
+    with pytest.raises(ClientError):
+        LogTailer(client, log_group_name, start_time=1000).poll()
+
+def test_merge_log_events():
+    first = [make_event('a', 1), make_event('c', 3), make_event('e', 3)]
+    second = [make_event('b', 2), make_event('d', 3)]
+
+    #Events with the same timestamp keep the order of their lists.
+    assert [event['eventId'] for event in merge_log_events([first, second, []])] == ['a', 'b', 'c', 'e', 'd']
+    assert merge_log_events([]) == []
+
+def test_parse_report_metrics():
+    message = "REPORT RequestId: 1234\tDuration: 102.25 ms\tBilled Duration: 200 ms\tMemory Size: 128 MB\tMax Memory Used: 35 MB\tInit Duration: 250.5 ms\t"
+
+    assert parse_log_metrics(message) == [('Duration (ms)', 102.25), ('Billed Duration (ms)', 200.0), ('Memory Size (MB)', 128.0), ('Max Memory Used (MB)', 35.0), ('Init Duration (ms)', 250.5)]
+
+def test_parse_embedded_metrics():
+    document = {
+        '_aws': {'Timestamp': 1, 'CloudWatchMetrics': [{'Namespace': 'RDK', 'Dimensions': [['RuleName']], 'Metrics': [
+            {'Name': 'Evaluate', 'Unit': 'Milliseconds'},
+            {'Name': 'ConfigurationCacheHits', 'Unit': 'Count'},
+            {'Name': 'Missing', 'Unit': 'Milliseconds'}
+        ]}]},
+        'RuleName': 'RuleA',
+        'Evaluate': 12.5,
+        'ConfigurationCacheHits': 3
+    }
+
+    assert parse_log_metrics("2017-11-15T22:00:00.000Z\t1234\t" + json.dumps(document)) == [('Evaluate (ms)', 12.5), ('ConfigurationCacheHits', 3.0)]
+    assert parse_log_metrics('{"_aws": not json') == []
+    assert parse_log_metrics('{"_aws": {}}') == []
+    assert parse_log_metrics("START RequestId: 1234") == []
+
+def test_archive_query(tmpdir):
+    archive = LogArchive(os.path.join(str(tmpdir), 'logs.db'))
+    try:
+        assert archive.store('/aws/lambda/RuleA', 'RuleA', [make_event('a1', 100, 'started 100%'), make_event('a2', 200, 'found rule_name'), make_event('a3', 300, 'found rulexname')]) == 3
+        assert archive.store('/aws/lambda/RuleB', 'RuleB', [make_event('b1', 150, 'started'), make_event('a1', 100, 'started 100%')]) == 1
+        assert archive.count() == 4
+
+        assert [event['eventId'] for event in archive.query(['RuleA'])] == ['a1', 'a2', 'a3']
+        assert 'ruleName' not in archive.query(['RuleA'])[0]
+        assert [(event['eventId'], event['ruleName']) for event in archive.query(['RuleA', 'RuleB'])] == [('a1', 'RuleA'), ('b1', 'RuleB'), ('a2', 'RuleA'), ('a3', 'RuleA')]
+        assert [event['eventId'] for event in archive.query(['RuleA', 'RuleB'], start_time=150, end_time=200)] == ['b1', 'a2']
+        assert [event['eventId'] for event in archive.query(['RuleA', 'RuleB'], number_of_events=2)] == ['a2', 'a3']
+
+        #Wildcard characters in the text only match themselves.
+        assert [event['eventId'] for event in archive.query(['RuleA'], text='rule_name')] == ['a2']
+        assert [event['eventId'] for event in archive.query(['RuleA', 'RuleB'], text='100% started')] == ['a1']
+    finally:
+        archive.close()
+
+def test_archive_checkpoints(tmpdir):
+    archive = LogArchive(os.path.join(str(tmpdir), 'logs.db'))
+    try:
+        assert archive.get_checkpoint('/aws/lambda/RuleA') is None
+        archive.set_checkpoint('/aws/lambda/RuleA', 'RuleA', 300)
+        assert archive.get_checkpoint('/aws/lambda/RuleA') == 300
+    finally:
+        archive.close()
@@ -0,0 +1,188 @@
+#    Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+#
+#        http://aws.amazon.com/apache2.0/
+#
+#    or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+import os
+import imp
+import json
+import datetime
+import pytest
+from botocore.stub import ANY
+from botocore.exceptions import ClientError
+from .conftest import make_client
+
+rule_util_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rdk', 'template', 'runtime', 'python3.6', 'rule_util.py')
+notification_time = '2017-11-15T22:00:00.000Z'
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+class FakeContext():
+    #Lambda's context, with a given number of seconds left for each time it is asked.
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:RuleA'
+
+    def __init__(self, remaining_seconds):
+        self.remaining_seconds = list(remaining_seconds)
+
+    def get_remaining_time_in_millis(self):
+        if len(self.remaining_seconds) > 1:
+            return self.remaining_seconds.pop(0) * 1000
+        return self.remaining_seconds[0] * 1000
+
+@pytest.fixture
+def rule_util(monkeypatch):
+    #A fresh copy for each test, since the module keeps its clients and cache between invocations.
+    module = imp.load_source('rdk_test_rule_util', rule_util_path)
+    monkeypatch.setattr(module, 'time', FakeClock())
+    return module
+
+@pytest.fixture
+def config_stubber(rule_util):
+    client, stubber = make_client('config')
+    rule_util.aws_config.client = client
+    stubber.activate()
+    yield stubber
+    stubber.assert_no_pending_responses()
+
+def make_evaluations(count):
+    return [{'ComplianceResourceType': 'AWS::EC2::Instance', 'ComplianceResourceId': 'i-' + str(index), 'ComplianceType': 'COMPLIANT', 'OrderingTimestamp': notification_time} for index in range(count)]
+
+def test_report_evaluations_in_chunks(rule_util, config_stubber):
+    evaluations = make_evaluations(250)
+    config_stubber.add_response('put_evaluations', {}, {'Evaluations': evaluations[:100], 'ResultToken': 'token', 'TestMode': False})
+    config_stubber.add_client_error('put_evaluations', service_error_code='ThrottlingException', service_message='Rate exceeded')
+    config_stubber.add_response('put_evaluations', {}, {'Evaluations': evaluations[100:200], 'ResultToken': 'token', 'TestMode': False})
+    failed = [{'ComplianceResourceType': 'AWS::EC2::Instance', 'ComplianceResourceId': 'i-249', 'ComplianceType': 'COMPLIANT', 'OrderingTimestamp': datetime.datetime(2017, 11, 15, 22)}]
+    config_stubber.add_response('put_evaluations', {'FailedEvaluations': failed}, {'Evaluations': evaluations[200:], 'ResultToken': 'token', 'TestMode': False})
+    metrics = {'evaluations': 0, 'calls': 0, 'retries': 0, 'dropped': 0}
+
+    assert rule_util.report_evaluations(evaluations, 'token', metrics=metrics) == 1
+    assert metrics == {'evaluations': 250, 'calls': 4, 'retries': 1, 'dropped': 1}
+
+def test_report_evaluations_drops_throttled_chunk(rule_util, config_stubber, capsys):
+    rule_util.MAX_RETRIES = 1
+    for attempt in range(2):
+        config_stubber.add_client_error('put_evaluations', service_error_code='ThrottlingException', service_message='Rate exceeded')
+
+    assert rule_util.report_evaluations(make_evaluations(3), 'token') == 3
+    output = capsys.readouterr().out
+    assert "Dropping 3 evaluations, PutEvaluations is still throttled after 1 retries." in output
+    assert "PutEvaluations: 3 evaluations in 2 calls, 1 retries, 3 dropped" in output
+
+def test_report_evaluations_raises_other_errors(rule_util, config_stubber):
+    config_stubber.add_client_error('put_evaluations', service_error_code='InvalidResultTokenException', service_message='Bad token')
+
+    with pytest.raises(ClientError):
+        rule_util.report_evaluations(make_evaluations(1), 'token')
+
+def test_call_with_retry_backs_off(rule_util):
+    calls = []
+
+    def api_call(**kwargs):
+        calls.append(rule_util.time.time())
+        if len(calls) < 3:
+            raise ClientError({'Error': {'Code': 'TooManyRequestsException', 'Message': 'Slow down'}}, 'Invoke')
+        return kwargs
+
+    assert rule_util.call_with_retry(api_call, Name='x') == ({'Name': 'x'}, 2)
+    assert calls[1] - calls[0] <= rule_util.RETRY_BASE_DELAY
+    assert calls[2] - calls[1] <= rule_util.RETRY_BASE_DELAY * 2
+
+def test_call_with_retry_stops_when_out_of_time(rule_util):
+    def api_call():
+        raise ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}, 'PutEvaluations')
+
+    with pytest.raises(ClientError) as error:
+        rule_util.call_with_retry(api_call, FakeContext([rule_util.RETRY_TIME_BUFFER]))
+    assert error.value.retries == 0
+
+def test_lru_cache_expiry(rule_util):
+    cache = rule_util.LRUCache(2, 60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+
+    #'b' is now the least recently used.
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+    rule_util.time.sleep(61)
+    assert cache.get('a') is None
+    assert cache.get('c') is None
+    assert (cache.hits, cache.misses) == (2, 3)
+    assert len(cache.items) == 0
+
+def make_resource_keys(ids):
+    return [{'resourceType': 'AWS::EC2::Instance', 'resourceId': resource_id} for resource_id in ids]
+
+def make_configuration_item(resource_id):
+    return {
+        'version': '1.3',
+        'accountId': '123456789012',
+        'configurationItemCaptureTime': datetime.datetime(2017, 11, 15, 21),
+        'configurationItemStatus': 'OK',
+        'arn': 'arn:aws:ec2:us-east-1:123456789012:instance/' + resource_id,
+        'resourceType': 'AWS::EC2::Instance',
+        'resourceId': resource_id,
+        'configuration': '{}'
+    }
+
+def make_sweep_event(cursor):
+    invoking_event = {'messageType': 'ScheduledNotification', 'notificationCreationTime': notification_time}
+    event = {
+        'invokingEvent': json.dumps(invoking_event),
+        'resultToken': 'token',
+        'eventLeftScope': False,
+        'configRuleName': 'RuleA',
+        'rdkSweep': {'sweepId': notification_time, 'shard': 1, 'startedAt': 900.0, 'cursor': cursor}
+    }
+    return event, invoking_event
+
+def stub_sweep_page(config_stubber, evaluated_ids):
+    #The resumed page has three resources, of which the previous shard evaluated the first.
+    config_stubber.add_response('list_discovered_resources', {'resourceIdentifiers': make_resource_keys(['i-1', 'i-2', 'i-3'])}, {'resourceType': 'AWS::EC2::Instance', 'nextToken': 'page2'})
+    config_stubber.add_response('batch_get_resource_config', {'baseConfigurationItems': [make_configuration_item(resource_id) for resource_id in ['i-2', 'i-3']]}, {'resourceKeys': make_resource_keys(['i-2', 'i-3'])})
+    evaluations = [{'ComplianceResourceType': 'AWS::EC2::Instance', 'ComplianceResourceId': resource_id, 'ComplianceType': 'COMPLIANT', 'OrderingTimestamp': notification_time} for resource_id in evaluated_ids]
+    config_stubber.add_response('put_evaluations', {}, {'Evaluations': evaluations, 'ResultToken': 'token', 'TestMode': False})
+
+def read_sweep_shard(output):
+    return [json.loads(line)['rdkSweep'] for line in output.splitlines() if line.startswith('{"rdkSweep"')][0]
+
+def test_sweep_resumes_from_cursor(rule_util, config_stubber, monkeypatch, capsys):
+    monkeypatch.setenv(rule_util.RESOURCE_TYPES_VARIABLE, 'AWS::EC2::Instance')
+    stub_sweep_page(config_stubber, ['i-2', 'i-3'])
+    event, invoking_event = make_sweep_event({'typeIndex': 0, 'nextToken': 'page2', 'resourceIndex': 1})
+
+    summary = rule_util.sweep_resources(lambda event, context: 'COMPLIANT', event, invoking_event, FakeContext([300]))
+
+    assert summary == {'resources': 2, 'evaluations': 2, 'errors': 0, 'dropped': 0, 'status': 'complete', 'shard': 1}
+    assert read_sweep_shard(capsys.readouterr().out)['cursor'] is None
+
+def test_sweep_hands_over_when_out_of_time(rule_util, config_stubber, monkeypatch, capsys):
+    monkeypatch.setenv(rule_util.RESOURCE_TYPES_VARIABLE, 'AWS::EC2::Instance')
+    stub_sweep_page(config_stubber, ['i-2'])
+    lambda_client, lambda_stubber = make_client('lambda')
+    lambda_stubber.add_response('invoke', {}, {'FunctionName': FakeContext.invoked_function_arn, 'InvocationType': 'Event', 'Payload': ANY})
+    lambda_stubber.activate()
+    rule_util.aws_lambda.client = lambda_client
+    event, invoking_event = make_sweep_event({'typeIndex': 0, 'nextToken': 'page2', 'resourceIndex': 1})
+
+    #Time runs out after i-2 has been evaluated.
+    summary = rule_util.sweep_resources(lambda event, context: 'COMPLIANT', event, invoking_event, FakeContext([300, 300, 5]))
+
+    assert summary['status'] == 'continued'
+    assert summary['resources'] == 1
+    assert read_sweep_shard(capsys.readouterr().out)['cursor'] == {'typeIndex': 0, 'nextToken': 'page2', 'resourceIndex': 2}
+    lambda_stubber.assert_no_pending_responses()
@@ -0,0 +1,63 @@
+#    Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+#
+#        http://aws.amazon.com/apache2.0/
+#
+#    or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+import os
+import json
+from rdk import testing
+
+#The second CI has a relationship with a resource type of its own, and strings with structural characters in them.
+test_cis = [
+    {'resourceType': 'AWS::EC2::Instance', 'resourceId': 'i-1', 'configuration': {'tags': []}},
+    {'relationships': [{'resourceType': 'AWS::EC2::VPC', 'resourceId': 'vpc-1'}], 'resourceType': 'AWS::EC2::SecurityGroup', 'resourceId': 'sg-"{[1'},
+    {'resourceId': 'untyped', 'configuration': {'resourceType': 'AWS::S3::Bucket'}}
+]
+
+def load_fixtures(tmpdir, file_name, content):
+    path = os.path.join(str(tmpdir), file_name)
+    with open(path, 'w') as fixture_file:
+        fixture_file.write(content)
+    return testing.TestCIFixtures([(path,) + entry for entry in testing.TestCIFixtures.index_file(path)])
+
+def check_fixtures(my_fixtures, cis):
+    assert len(my_fixtures) == len(cis)
+    assert list(my_fixtures) == cis
+    assert [my_fixtures[index] for index in range(len(cis))] == cis
+    assert [entry[3] for entry in my_fixtures.entries] == [ci.get('resourceType') for ci in cis]
+
+def test_index_array_with_one_ci_per_line(tmpdir):
+    content = "[\n" + ",\n".join(json.dumps(ci) for ci in test_cis) + "\n]\n"
+    check_fixtures(load_fixtures(tmpdir, 'array.json', content), test_cis)
+
+def test_index_one_ci_per_line(tmpdir):
+    content = "\n".join(json.dumps(ci) for ci in test_cis) + "\n"
+    check_fixtures(load_fixtures(tmpdir, 'cis.jsonl', content), test_cis)
+
+def test_index_pretty_printed_array(tmpdir):
+    check_fixtures(load_fixtures(tmpdir, 'pretty.json', json.dumps(test_cis, indent=4)), test_cis)
+
+def test_index_single_ci(tmpdir):
+    check_fixtures(load_fixtures(tmpdir, 'single.json', json.dumps(test_cis[1], indent=2)), [test_cis[1]])
+    check_fixtures(load_fixtures(tmpdir, 'single_line.json', json.dumps(test_cis[1])), [test_cis[1]])
+
+def test_index_empty_file(tmpdir):
+    assert len(load_fixtures(tmpdir, 'empty.json', "")) == 0
+
+def test_filter_by_resource_type(tmpdir):
+    my_fixtures = load_fixtures(tmpdir, 'pretty.json', json.dumps(test_cis, indent=4))
+
+    assert list(my_fixtures.filter(['AWS::EC2::SecurityGroup', 'AWS::EC2::VPC'])) == [test_cis[1]]
+    assert len(my_fixtures.filter(['AWS::S3::Bucket'])) == 0
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert testing.percentile(values, 50) == 50
+    assert testing.percentile(values, 95) == 95
+    assert testing.percentile(values, 99.5) == 100
+    assert testing.percentile([7], 99) == 7
+    assert testing.percentile([1, 2, 3, 4], 0) == 1